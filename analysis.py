@@ -1,78 +1,585 @@
-from sklearn.feature_extraction.text import CountVectorizer
-from gensim import corpora, models
-import pyLDAvis.gensim_models
-import pyLDAvis
 import pandas as pd
+import os
+import json
+import time
+import tempfile
+import itertools
+import numpy as np
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from preprocess import CommentStream, CommentDetails
+from lda_vis import LDAVisCache
+from instrumentation import stage
+
+# gensim、pyLDAvis导入较慢，只在训练或可视化时才导入，
+# 仅使用已保存结果或语料的代码（如后台任务列表、批处理的爬取阶段）不需要加载它们
+
+class TrainingProgress:
+    """
+    LDA训练回调：每完成一轮(pass)调用一次on_pass(已完成轮数)
+    实现gensim.models.callbacks.Metric的接口，但不继承它，导入本模块时无需加载gensim
+    """
+    
+    def __init__(self, on_pass):
+        self.on_pass = on_pass
+        self.logger = None
+        self.title = 'pass'
+        self.passes_done = 0
+    
+    def __str__(self):
+        return self.title
+    
+    def get_value(self, **kwargs):
+        self.passes_done += 1
+        self.on_pass(self.passes_done)
+        return self.passes_done
+
+
+class ConvergenceMonitor:
+    """
+    LDA自适应训练的停止条件：每轮结束后检查模型的变化，变化小于tol、达到max_passes
+    或超出max_time时停止
+    metric为'drift'时比较相邻两轮的主题-词分布，取各主题总变差距离的最大值，几乎没有额外开销；
+    为'perplexity'时在前eval_docs篇文档上计算困惑度，以相对下降幅度判断，每轮多一次推断
+    """
+    
+    DEFAULT_TOL = {'drift': 0.02, 'perplexity': 0.005}
+    
+    def __init__(self, metric='drift', tol=None, max_passes=20, min_passes=2, max_time=None, eval_docs=2000):
+        """
+        :param tol: 收敛阈值，默认drift为0.02、perplexity为0.005
+        :param max_passes: 最多训练的轮数
+        :param min_passes: 至少训练的轮数
+        :param max_time: 训练时间预算（秒），超出后在当前轮结束时停止
+        """
+        if metric not in self.DEFAULT_TOL:
+            raise ValueError(f"不支持的收敛指标: {metric}")
+        self.metric = metric
+        self.tol = self.DEFAULT_TOL[metric] if tol is None else tol
+        self.max_passes = max_passes
+        self.min_passes = min_passes
+        self.max_time = max_time
+        self.eval_docs = eval_docs
+        self.history = []
+        self.stop_reason = None
+        self._previous = None
+        self._eval_corpus = None
+        self._start = time.perf_counter()
+    
+    def _measure(self, lda_model, corpus):
+        if self.metric == 'drift':
+            topics = lda_model.get_topics()
+            previous, self._previous = self._previous, topics
+            if previous is None:
+                return None
+            return float(0.5 * np.abs(topics - previous).sum(axis=1).max())
+        if self._eval_corpus is None:
+            self._eval_corpus = list(itertools.islice(corpus, self.eval_docs))
+        perplexity = float(np.exp2(-lda_model.log_perplexity(self._eval_corpus)))
+        previous, self._previous = self._previous, perplexity
+        if previous is None:
+            return None
+        return (previous - perplexity) / previous
+    
+    def check(self, lda_model, corpus):
+        """
+        在一轮训练结束后调用
+        :return: 是否应停止训练
+        """
+        value = self._measure(lda_model, corpus)
+        passes = len(self.history) + 1
+        self.history.append(round(value, 6) if value is not None else None)
+        if passes >= self.max_passes:
+            self.stop_reason = 'max_passes'
+        elif self.max_time is not None and time.perf_counter() - self._start >= self.max_time:
+            self.stop_reason = 'max_time'
+        elif passes >= self.min_passes and value is not None and value < self.tol:
+            self.stop_reason = 'converged'
+        return self.stop_reason is not None
+    
+    def report(self):
+        """实际训练轮数、停止原因和每轮的变化量"""
+        return {
+            'passes': len(self.history),
+            'stop_reason': self.stop_reason,
+            'metric': self.metric,
+            'tol': self.tol,
+            'history': self.history,
+            'elapsed_s': round(time.perf_counter() - self._start, 3),
+        }
+
 
 class CommentAnalyzer:
-    def __init__(self, processed_comments, comment_details):
+    def __init__(self, processed_comments, comment_details, product_id=None, model_dir='models'):
+        """
+        :param product_id: 商品ID，指定后训练的模型和词典会保存到 model_dir/<商品ID>/<情感>/
+        :param model_dir: 模型保存的根目录
+        """
         self.positive = processed_comments['positive']
         self.negative = processed_comments['negative']
         self.comment_details = comment_details
+        self.product_id = product_id
+        self.model_dir = model_dir
+        self.vis_cache = LDAVisCache()
+        self._tmp_dir = None
+        self._lock = threading.Lock()
     
-    def run_lda(self, texts, num_topics=5):
+    @classmethod
+    def from_stream(cls, preprocessor, file_path=None, read_chunk_size=10000, **kwargs):
+        """
+        基于流式预处理结果创建分析器，语料和评论详情都不常驻内存
+        每次遍历语料时都会重新流式读取源文件
+        """
+        processed_comments = {}
+        comment_details = {}
+        for sentiment in ('positive', 'negative'):
+            processed_comments[sentiment] = CommentStream(
+                preprocessor, file_path, sentiment, 'words', read_chunk_size)
+            comment_details[sentiment] = CommentStream(
+                preprocessor, file_path, sentiment, 'details', read_chunk_size)
+        return cls(processed_comments, comment_details, **kwargs)
+    
+    @classmethod
+    def from_corpus(cls, corpus, **kwargs):
+        """基于内存映射的CompactCorpus创建分析器，评论详情按需从源文件取回"""
+        views = {sentiment: corpus.view(sentiment) for sentiment in ('positive', 'negative')}
+        return cls(views, views, **kwargs)
+    
+    def build_corpus(self, texts):
+        """
+        创建词典和文档-词频语料
+        texts为列表时语料保存在内存中；为流式语料时序列化为磁盘上的MmCorpus，
+        训练时逐块读取，内存占用与语料大小无关
+        """
+        # 紧凑语料直接由词ID数组构造，无需重新遍历分词结果
+        if hasattr(texts, 'lda_inputs'):
+            return texts.lda_inputs()
+        
+        from gensim import corpora
+        
         # 创建词典
         dictionary = corpora.Dictionary(texts)
         
         # 创建文档-词频矩阵
-        corpus = [dictionary.doc2bow(text) for text in texts]
+        if isinstance(texts, list):
+            return dictionary, [dictionary.doc2bow(text) for text in texts]
+        
+        with self._lock:
+            if self._tmp_dir is None:
+                self._tmp_dir = tempfile.TemporaryDirectory()
+        corpus_path = os.path.join(self._tmp_dir.name, f'corpus_{id(texts)}.mm')
+        corpora.MmCorpus.serialize(corpus_path, (dictionary.doc2bow(text) for text in texts))
+        return dictionary, corpora.MmCorpus(corpus_path)
+    
+    def run_lda(self, texts, num_topics=5, workers=1, random_state=None, with_vis=True, progress=None,
+                passes=20, early_stopping=None):
+        """
+        训练LDA模型
+        :param workers: 训练进程数，大于1时使用多进程的LdaMulticore
+        :param random_state: 随机种子，固定后结果可复现
+        :param with_vis: 是否同时计算pyLDAvis数据；为False时返回的vis_data为None，
+                         需要时再用visualize按需生成
+        :param progress: 可选的回调progress(已完成轮数, 总轮数)。
+                         固定轮数时LdaMulticore不支持逐轮回调，只在训练结束时调用一次
+        :param passes: 固定训练的轮数；自适应训练时为轮数上限
+        :param early_stopping: 为None时固定训练passes轮；为True或ConvergenceMonitor的参数字典时
+                               逐轮训练，收敛或超出时间预算后提前停止。
+                               实际训练的轮数保存在lda_model.passes，停止原因等保存在lda_model.training
+        """
+        from gensim import models
+        
+        with stage('build_corpus') as record:
+            dictionary, corpus = self.build_corpus(texts)
+            record['items'] = len(corpus)
+            record['vocabulary'] = len(dictionary)
         
         # 训练LDA模型
-        lda_model = models.LdaModel(
-            corpus=corpus,
-            num_topics=num_topics,
-            id2word=dictionary,
-            passes=20
-        )
+        with stage('lda_train', items=len(corpus), num_topics=num_topics, workers=workers,
+                   passes=passes, early_stopping=bool(early_stopping)) as record:
+            if early_stopping:
+                options = early_stopping if isinstance(early_stopping, dict) else {}
+                monitor = ConvergenceMonitor(**{'max_passes': passes, **options})
+                lda_model = self._train_adaptive(corpus, dictionary, num_topics, workers, random_state,
+                                                 monitor, progress)
+                lda_model.training = monitor.report()
+                record['passes'] = lda_model.passes
+                record['stop_reason'] = monitor.stop_reason
+            elif workers > 1:
+                lda_model = models.LdaMulticore(
+                    corpus=corpus,
+                    num_topics=num_topics,
+                    id2word=dictionary,
+                    passes=passes,
+                    workers=workers,
+                    random_state=random_state
+                )
+                if progress:
+                    progress(passes, passes)
+            else:
+                lda_model = models.LdaModel(
+                    corpus=corpus,
+                    num_topics=num_topics,
+                    id2word=dictionary,
+                    passes=passes,
+                    random_state=random_state,
+                    callbacks=[TrainingProgress(lambda done: progress(done, passes))] if progress else None
+                )
+                # 回调只在训练时使用，去掉后模型才能被保存
+                lda_model.callbacks = None
         
         # 可视化
-        vis_data = pyLDAvis.gensim_models.prepare(lda_model, corpus, dictionary)
+        vis_data = None
+        if with_vis:
+            import pyLDAvis.gensim_models
+            with stage('ldavis_prepare', items=len(corpus)):
+                vis_data = pyLDAvis.gensim_models.prepare(lda_model, corpus, dictionary)
         return lda_model, vis_data
     
-    def save_analysis_results(self, comment_type, topics):
-        """保存分析结果到CSV"""
+    @staticmethod
+    def _train_adaptive(corpus, dictionary, num_topics, workers, random_state, monitor, progress=None):
+        """
+        每次调用update只训练一轮，每轮结束后由monitor判断是否停止
+        gensim在同一次update的多轮训练中只在第一轮累加文档数和更新次数，学习率随轮次衰减；
+        这里在后续各轮之前恢复这两项并调整offset，使学习率与一次训练多轮基本一致
+        """
+        from gensim import models
+        
+        if workers > 1:
+            lda_model = models.LdaMulticore(num_topics=num_topics, id2word=dictionary, passes=1,
+                                            workers=workers, random_state=random_state, eval_every=None)
+        else:
+            lda_model = models.LdaModel(num_topics=num_topics, id2word=dictionary, passes=1,
+                                        random_state=random_state, eval_every=None)
+        offset = lda_model.offset
+        num_updates = 0
+        for pass_ in range(monitor.max_passes):
+            if pass_ > 0:
+                lda_model.state.numdocs -= len(corpus)
+                lda_model.num_updates = num_updates
+                lda_model.offset = offset + pass_
+            lda_model.update(corpus)
+            if pass_ == 0:
+                num_updates = lda_model.num_updates
+            stop = monitor.check(lda_model, corpus)
+            if progress:
+                progress(pass_ + 1, pass_ + 1 if stop else monitor.max_passes)
+            if stop:
+                break
+        lda_model.offset = offset
+        lda_model.num_updates = num_updates
+        lda_model.passes = len(monitor.history)
+        return lda_model
+    
+    def visualize(self, lda_model, texts, mds='pcoa', max_terms=None, lambda_step=0.01):
+        """
+        生成模型的pyLDAvis HTML，结果按模型指纹缓存
+        参数说明见lda_vis.prepare_vis
+        """
+        with stage('ldavis', num_topics=lda_model.num_topics, max_terms=max_terms):
+            return self.vis_cache.get_html(lda_model, texts, mds, max_terms, lambda_step)
+    
+    def model_path(self, sentiment):
+        return os.path.join(self.model_dir, str(self.product_id), sentiment)
+    
+    def save_model(self, sentiment, lda_model):
+        """保存某一情感的LDA模型及其词典（即lda_model.id2word）"""
+        path = self.model_path(sentiment)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        lda_model.save(os.path.join(path, 'lda.model'))
+        lda_model.id2word.save(os.path.join(path, 'dictionary.dict'))
+        with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                'num_topics': lda_model.num_topics,
+                'num_terms': len(lda_model.id2word),
+                'num_docs': int(lda_model.state.numdocs),
+                'passes': lda_model.passes,
+                'training': getattr(lda_model, 'training', None),
+                'updated_at': datetime.now().isoformat(timespec='seconds')
+            }, f, ensure_ascii=False, indent=2)
+    
+    def load_model(self, sentiment):
+        """加载已保存的模型，不存在时返回None"""
+        model_file = os.path.join(self.model_path(sentiment), 'lda.model')
+        if not os.path.exists(model_file):
+            return None
+        from gensim import corpora, models
+        lda_model = models.LdaModel.load(model_file)
+        lda_model.id2word = corpora.Dictionary.load(os.path.join(self.model_path(sentiment), 'dictionary.dict'))
+        return lda_model
+    
+    @staticmethod
+    def _expand_vocabulary(lda_model, dictionary):
+        """
+        词典新增词后扩展模型的词表维度
+        已有词的主题-词统计量原样保留，新词从先验开始，由后续的在线更新学习
+        """
+        from gensim import models
+        
+        old_terms = lda_model.num_terms
+        extra = len(dictionary) - old_terms
+        eta = lda_model.eta
+        if eta.ndim == 1:
+            eta = np.concatenate([eta, np.full(extra, eta.mean())])
+        else:
+            eta = np.hstack([eta, np.repeat(eta.mean(axis=1, keepdims=True), extra, axis=1)])
+        
+        expanded = models.LdaModel(
+            num_topics=lda_model.num_topics,
+            id2word=dictionary,
+            alpha=lda_model.alpha,
+            eta=eta,
+            decay=lda_model.decay,
+            offset=lda_model.offset,
+            passes=lda_model.passes,
+            chunksize=lda_model.chunksize,
+            random_state=lda_model.random_state
+        )
+        sstats = np.zeros((lda_model.num_topics, len(dictionary)), dtype=lda_model.state.sstats.dtype)
+        sstats[:, :old_terms] = lda_model.state.sstats
+        expanded.state.sstats = sstats
+        expanded.state.numdocs = lda_model.state.numdocs
+        expanded.num_updates = lda_model.num_updates
+        expanded.sync_state()
+        return expanded
+    
+    def update_lda(self, sentiment, new_texts, num_topics=5, random_state=None):
+        """
+        用新评论在线更新已保存的模型，词典随新词增长；没有已保存的模型时从头训练
+        新评论按其在全部评论中的占比并入已有主题，耗时只与新评论数量有关
+        """
+        new_texts = list(new_texts)
+        lda_model = self.load_model(sentiment)
+        if lda_model is None:
+            if not new_texts:
+                return None
+            lda_model, _ = self.run_lda(new_texts, num_topics, random_state=random_state, with_vis=False)
+        elif new_texts:
+            dictionary = lda_model.id2word
+            dictionary.add_documents(new_texts)
+            if len(dictionary) > lda_model.num_terms:
+                lda_model = self._expand_vocabulary(lda_model, dictionary)
+            bows = [dictionary.doc2bow(text) for text in new_texts]
+            # 只过一轮并作为一个批次合并：学习率rho = 新评论数 / 全部评论数，
+            # 使新评论在主题中的权重与其占比相当，而不是按训练轮数反复向新批次靠拢、覆盖已有主题
+            total = lda_model.state.numdocs + len(bows)
+            lda_model.update(bows, chunksize=len(bows), passes=1, decay=1.0,
+                             offset=(total - lda_model.num_updates) / len(bows))
+        self.save_model(sentiment, lda_model)
+        return lda_model
+    
+    def state_path(self):
+        return os.path.join(self.model_dir, str(self.product_id), 'state.json')
+    
+    def load_state(self):
+        """模型训练或更新时读取的源文件及行数，没有记录时返回空字典"""
+        if not os.path.exists(self.state_path()):
+            return {}
+        with open(self.state_path(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def save_state(self, source, source_rows):
+        """记录模型已读取到源文件的第几行，供update_from_file只读取之后追加的评论"""
+        with open(self.state_path(), 'w', encoding='utf-8') as f:
+            json.dump({'source': source, 'source_rows': int(source_rows)}, f, ensure_ascii=False, indent=2)
+    
+    def training_source(self):
+        """
+        训练语料对应的源文件及已读取的行数（最后一条评论的行号+1）
+        流式语料或源为DataFrame时无法确定，返回None
+        """
+        sources = set()
+        rows = 0
+        for details in (self.comment_details.get('positive'), self.comment_details.get('negative')):
+            if hasattr(details, 'corpus'):
+                sources.add(details.corpus.meta.get('source'))
+            elif isinstance(details, CommentDetails):
+                sources.add(details.source)
+            else:
+                return None
+            if len(details):
+                rows = max(rows, int(np.max(details.rows)) + 1)
+        source = sources.pop() if len(sources) == 1 else None
+        return (source, rows) if isinstance(source, str) else None
+    
+    def can_update(self, file_path, num_topics=None):
+        """
+        是否可以用update_from_file增量更新：已有保存的模型，且记录的源文件就是file_path
+        :param num_topics: 指定时还要求已保存模型的主题数与之一致
+        """
+        state = self.load_state()
+        if not state.get('source') or os.path.abspath(state['source']) != os.path.abspath(file_path):
+            return False
+        models = [self.model_path(sentiment) for sentiment in ('positive', 'negative')
+                  if os.path.exists(os.path.join(self.model_path(sentiment), 'lda.model'))]
+        if not models:
+            return False
+        if num_topics is not None:
+            for path in models:
+                with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+                    if json.load(f)['num_topics'] != num_topics:
+                        return False
+        return True
+    
+    def update_from_file(self, preprocessor, file_path, num_topics=5, random_state=None):
+        """
+        读取商品评论CSV中上次训练或更新之后追加的评论，在线更新正面和负面模型
+        已处理到的行号记录在 model_dir/<商品ID>/state.json 中；已有模型却没有file_path的记录时
+        无法区分新旧评论，抛出ValueError
+        :return: {情感: 新评论数}
+        """
+        has_models = any(os.path.exists(os.path.join(self.model_path(sentiment), 'lda.model'))
+                         for sentiment in ('positive', 'negative'))
+        start_row = 0
+        if has_models:
+            if not self.can_update(file_path):
+                raise ValueError(f"商品{self.product_id}的模型没有记录{file_path}已读取的行数，"
+                                 f"无法增量更新，请先用analyze重新训练")
+            start_row = self.load_state()['source_rows']
+        
+        new_texts = {'positive': [], 'negative': []}
+        next_row = start_row
+        for record in preprocessor.stream_comments(file_path, start_row=start_row):
+            new_texts[record['sentiment']].append(record['words'])
+            next_row = record['row'] + 1
+        
+        for sentiment, texts in new_texts.items():
+            if texts:
+                self.update_lda(sentiment, texts, num_topics, random_state)
+        
+        if any(new_texts.values()) or has_models:
+            self.save_state(file_path, next_row)
+        return {sentiment: len(texts) for sentiment, texts in new_texts.items()}
+    
+    def save_analysis_results(self, comment_type, topics, output_dir=None):
+        """
+        保存分析结果到CSV
+        :param output_dir: 输出目录，指定后文件名不带时间戳（analysis_<类型>.csv、topics_<类型>.txt），
+                           每次运行覆盖上一次的结果；不指定时在当前目录按时间戳命名
+        """
         details = self.comment_details[comment_type]
-        df = pd.DataFrame(details)
         
         # 添加主题分析结果
         topic_str = []
         for idx, topic in topics:
             topic_str.append(f"主题{idx+1}: {topic}")
         
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f'analysis_{comment_type}_{timestamp}.csv'
+        if output_dir:
+            if not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+            filename = os.path.join(output_dir, f'analysis_{comment_type}.csv')
+            topics_file = os.path.join(output_dir, f'topics_{comment_type}.txt')
+        else:
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            filename = f'analysis_{comment_type}_{timestamp}.csv'
+            topics_file = f'topics_{comment_type}_{timestamp}.txt'
         
         # 保存评论详情
-        df.to_csv(filename, index=False, encoding='utf-8-sig')
+        with stage('save_results', sentiment=comment_type,
+                   items=len(details) if hasattr(details, '__len__') else None):
+            if hasattr(details, 'to_frame'):
+                details.to_frame().to_csv(filename, index=False, encoding='utf-8-sig')
+            elif isinstance(details, list):
+                df = pd.DataFrame(details)
+                df.to_csv(filename, index=False, encoding='utf-8-sig')
+            else:
+                self._write_details_streaming(details, filename)
         
         # 保存主题分析结果
-        with open(f'topics_{comment_type}_{timestamp}.txt', 'w', encoding='utf-8') as f:
+        with open(topics_file, 'w', encoding='utf-8') as f:
             f.write('\n\n'.join(topic_str))
         
         return filename
     
-    def analyze(self):
-        results = {}
+    @staticmethod
+    def _write_details_streaming(details, filename, batch_size=10000):
+        """分批写出流式的评论详情，避免一次性构造整个DataFrame"""
+        batch = []
+        first = True
         
-        # 分析正面评论
-        pos_lda, pos_vis = self.run_lda(self.positive)
-        pos_topics = pos_lda.print_topics()
-        results['positive'] = {
-            'lda': pos_lda,
-            'vis': pos_vis,
-            'topics': pos_topics,
-            'file': self.save_analysis_results('positive', pos_topics)
-        }
+        def flush():
+            df = pd.DataFrame(batch, columns=['content', 'score', 'time'])
+            df.to_csv(filename, mode='w' if first else 'a', header=first, index=False,
+                      encoding='utf-8-sig' if first else 'utf-8')
         
-        # 分析负面评论
-        neg_lda, neg_vis = self.run_lda(self.negative)
-        neg_topics = neg_lda.print_topics()
-        results['negative'] = {
-            'lda': neg_lda,
-            'vis': neg_vis,
-            'topics': neg_topics,
-            'file': self.save_analysis_results('negative', neg_topics)
-        }
+        for detail in details:
+            batch.append(detail)
+            if len(batch) >= batch_size:
+                flush()
+                batch = []
+                first = False
+        if batch or first:
+            flush()
+    
+    def analyze(self, num_topics=5, workers=1, random_state=None, with_vis=False, output_dir=None,
+                passes=20, early_stopping=None):
+        """
+        分别对正面和负面评论做主题分析并保存结果，没有评论的情感类别会被跳过
+        :param workers: 总训练进程数，大于1时正负面模型同时训练，各使用一半进程
+        :param with_vis: 是否计算pyLDAvis数据，批处理时默认跳过
+        :param output_dir: 分析结果的输出目录，见save_analysis_results
+        :param passes: 训练轮数（自适应训练时为上限）
+        :param early_stopping: 自适应训练的设置，见run_lda
+        """
+        texts = {}
+        for sentiment, sentiment_texts in (('positive', self.positive), ('negative', self.negative)):
+            if any(True for _ in sentiment_texts):
+                texts[sentiment] = sentiment_texts
+            else:
+                print(f"没有{sentiment}评论，跳过主题分析")
         
-        return results 
\ No newline at end of file
+        if workers > 1:
+            per_model = max(1, workers // 2)
+            with ThreadPoolExecutor(max_workers=len(texts) or 1) as executor:
+                futures = {
+                    sentiment: executor.submit(self.run_lda, texts[sentiment], num_topics, per_model, random_state,
+                                               with_vis, passes=passes, early_stopping=early_stopping)
+                    for sentiment in texts
+                }
+                trained = {sentiment: future.result() for sentiment, future in futures.items()}
+        else:
+            trained = {
+                sentiment: self.run_lda(texts[sentiment], num_topics, random_state=random_state, with_vis=with_vis,
+                                        passes=passes, early_stopping=early_stopping)
+                for sentiment in texts
+            }
+        
+        if self.product_id is not None:
+            for sentiment, (lda, _) in trained.items():
+                self.save_model(sentiment, lda)
+            # 记录训练读取到的行数，之后update_from_file只读取追加的评论
+            watermark = self.training_source()
+            if watermark:
+                self.save_state(*watermark)
+            elif os.path.exists(self.state_path()):
+                os.remove(self.state_path())
+        
+        return {sentiment: self._result(sentiment, lda, vis, output_dir) for sentiment, (lda, vis) in trained.items()}
+    
+    def analyze_update(self, preprocessor, file_path, num_topics=5, random_state=None, output_dir=None):
+        """
+        用file_path中新追加的评论在线更新已保存的模型（见update_from_file），不重新训练，
+        然后与analyze一样输出主题和评论详情
+        :return: 与analyze相同的结果，每个情感另有new_comments（本次新计入的评论数）
+        """
+        added = self.update_from_file(preprocessor, file_path, num_topics, random_state)
+        results = {}
+        for sentiment in ('positive', 'negative'):
+            lda = self.load_model(sentiment)
+            if lda is None:
+                continue
+            results[sentiment] = self._result(sentiment, lda, None, output_dir)
+            results[sentiment]['new_comments'] = added[sentiment]
+        return results
+    
+    def _result(self, sentiment, lda, vis, output_dir):
+        topics = lda.print_topics()
+        return {
+            'lda': lda,
+            'vis': vis,
+            'topics': topics,
+            'passes': lda.passes,
+            'training': getattr(lda, 'training', None),
+            'file': self.save_analysis_results(sentiment, topics, output_dir)
+        }
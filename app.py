@@ -1,58 +1,226 @@
 import streamlit as st
-import json
 import pandas as pd
 import numpy as np
-from jd_crawler import JDCommentCrawler
 from preprocess import CommentPreprocessor
+from seg_cache import SegmentationCache
+from corpus_store import CompactCorpus
+from topic_sweep import TopicSweep
 from analysis import CommentAnalyzer
-import pyLDAvis
-import tempfile
+from job_queue import JobRunner
+from topic_trends import TopicTrendIndex
+from instrumentation import metrics, stage, profile_summary
 import os
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.cluster import KMeans
-import matplotlib.pyplot as plt
-from collections import Counter
-from sklearn.decomposition import PCA
 
 class StreamlitApp:
     def __init__(self):
         st.set_page_config(page_title="京东评论分析", layout="wide")
-        self.temp_dir = tempfile.mkdtemp()
     
-    def perform_kmeans_analysis(self, texts, n_clusters=5):
+    @staticmethod
+    @st.cache_resource
+    def get_segmentation_cache():
+        """在所有会话和重跑之间共享同一个分词缓存"""
+        return SegmentationCache()
+    
+    def load_corpus(self, csv_path):
+        """
+        获取CSV对应的紧凑语料：不存在、源文件已更新或停用词表等分词配置已变化时重新预处理，
+        否则直接以内存映射方式打开
         """
-        执行K-means聚类分析
-        :param texts: 评论文本列表
-        :param n_clusters: 聚类数量
-        :return: 聚类结果、可视化图表和降维后的数据
+        name = os.path.splitext(os.path.basename(csv_path))[0]
+        corpus_dir = os.path.join('corpus', name)
+        with stage('load_corpus', file=csv_path) as record, CompactCorpus.locked(corpus_dir):
+            # 分词结果缓存在磁盘上，重复或重叠的文件几乎无需重新分词
+            preprocessor = CommentPreprocessor(cache=self.get_segmentation_cache())
+            record['rebuilt'] = not CompactCorpus.is_fresh(corpus_dir, csv_path,
+                                                           fingerprint=preprocessor.fingerprint())
+            if record['rebuilt']:
+                CompactCorpus.from_file(preprocessor, csv_path, corpus_dir)
+            corpus = CompactCorpus.open(corpus_dir)
+            record['items'] = len(corpus)
+        return corpus
+    
+    @staticmethod
+    @st.cache_resource
+    def get_job_runner():
+        """整个服务共享一个后台任务执行器"""
+        return JobRunner()
+    
+    @st.fragment(run_every=2)
+    def show_jobs(self, runner):
+        """任务列表，每2秒自动刷新进度"""
+        jobs = runner.list(limit=10)
+        if not jobs:
+            return
+        st.subheader("后台任务")
+        for job in jobs:
+            progress = job['progress']
+            if job['kind'] == 'crawl':
+                title = f"爬取 {job['params']['product_id']}"
+                detail = (f"好评 {progress.get('good_pages', 0)} 页 / {progress.get('good_comments', 0)} 条，"
+                          f"差评 {progress.get('bad_pages', 0)} 页 / {progress.get('bad_comments', 0)} 条")
+            elif job['kind'] == 'sweep':
+                title = f"主题数扫描 {os.path.basename(job['params']['file'])}（{job['params']['sentiment']}）"
+                detail = (f"已分词 {progress.get('segmented', 0)} 条，"
+                          f"已训练 {progress.get('swept', 0)}/{progress.get('sweep_total', 9)} 个主题数，"
+                          f"阶段：{progress.get('stage', '排队中')}")
+            else:
+                title = f"分析 {os.path.basename(job['params']['file'])}（{job['params']['sentiment']}）"
+                detail = (f"已分词 {progress.get('segmented', 0)} 条，"
+                          f"LDA第 {progress.get('lda_pass', 0)}/{progress.get('lda_passes', 20)} 轮，"
+                          f"阶段：{progress.get('stage', '排队中')}")
+            
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                st.write(f"**{title}** · {job['status']} · {detail}")
+                if job['status'] == 'running' and job['kind'] == 'analysis':
+                    st.progress(progress.get('lda_pass', 0) / progress.get('lda_passes', 20))
+                if job['status'] == 'running' and job['kind'] == 'sweep':
+                    st.progress(progress.get('swept', 0) / progress.get('sweep_total', 9))
+                if job['status'] == 'failed':
+                    st.error(job['error'].splitlines()[0])
+                if job['status'] == 'done' and job['kind'] == 'crawl':
+                    st.caption(f"已保存至: {job['result']['file']}")
+            with col2:
+                if job['status'] == 'done' and job['kind'] == 'analysis':
+                    if st.button("查看结果", key=f"show_{job['id']}"):
+                        st.session_state['analysis_view'] = job['result']
+                        st.rerun()
+                if job['status'] == 'done' and job['kind'] == 'sweep':
+                    if st.button("查看结果", key=f"show_{job['id']}"):
+                        # JSON中的主题数键为字符串
+                        scores = {int(k): score for k, score in job['result']['scores'].items()}
+                        sweeps = st.session_state.setdefault('topic_sweeps', {})
+                        sweeps[(job['params']['file'], job['params']['sentiment'])] = \
+                            (job['result']['fingerprint'], scores)
+                        st.rerun()
+    
+    def show_trends(self, product_id, sentiment, db_path=os.path.join('models', 'topic_trends.db')):
         """
-        # 将分词后的文本转换为字符串
-        text_strings = [' '.join(text) for text in texts]
+        主题趋势索引中该商品各时间段的主题占比，索引由批处理（--trends）或topic_trends.py维护
+        没有该商品的数据时不显示
+        """
+        if not os.path.exists(db_path):
+            return
+        index = TopicTrendIndex(db_path)
+        try:
+            if index.pinned_model(product_id, sentiment) is None:
+                return
+            st.subheader("主题趋势")
+            col1, col2 = st.columns(2)
+            with col1:
+                days = st.select_slider("时间范围（天）", options=[30, 90, 180, 365], value=90)
+            with col2:
+                granularity = st.radio("时间粒度", ['week', 'day'], horizontal=True,
+                                       format_func=lambda g: "按周" if g == 'week' else "按天")
+            share = index.topic_share(product_id, sentiment, days, granularity)
+            if share.empty:
+                st.info("该时间范围内没有评论")
+                return
+            labels = index.topic_labels(product_id, sentiment)
+            share.columns = [f"主题{topic + 1}: {' '.join(labels[topic][:3])}" for topic in share.columns]
+            st.area_chart(share)
+        finally:
+            index.close()
+    
+    def show_metrics(self, view=None):
+        """
+        侧边栏性能面板：本服务进程中各阶段的耗时，以及当前分析结果所属任务的耗时
+        内存列为各阶段抬高进程内存峰值的量，进程峰值一列是整个进程的，不代表该阶段本身
+        """
+        columns = {'calls': 'calls', 'wall_s': 'wall_s', 'cpu_s': 'cpu_s', 'items': 'items',
+                   'items_per_s': 'items_per_s', 'rss_growth_mb': '内存增长(MB)', 'peak_rss_mb': '进程峰值(MB)'}
         
-        # TF-IDF向量化
-        vectorizer = TfidfVectorizer()
-        X = vectorizer.fit_transform(text_strings)
+        def table(summary):
+            # 旧任务的结果中没有rss_growth_mb，显示为空
+            return pd.DataFrame(summary).T.reindex(columns=list(columns)).rename(columns=columns)
         
-        # 使用PCA降维到2维以便可视化
-        pca = PCA(n_components=2)
-        X_pca = pca.fit_transform(X.toarray())
+        with st.sidebar:
+            st.header("性能指标")
+            summary = metrics.summary()
+            if summary:
+                st.caption("页面进程（加载语料、可视化等）")
+                st.dataframe(table(summary))
+            
+            if view and view.get('metrics'):
+                st.caption("当前分析任务")
+                st.dataframe(table(view['metrics']))
+            
+            request_stats = metrics.request_stats()
+            if request_stats['requests']:
+                st.caption("爬虫请求")
+                st.json(request_stats)
+            
+            if view and view.get('profile') and os.path.exists(view['profile']):
+                with st.expander("cProfile：耗时最多的函数"):
+                    st.code(profile_summary(view['profile']))
+                    with open(view['profile'], 'rb') as f:
+                        st.download_button("下载cProfile数据", f.read(), file_name='profile.prof')
+    
+    def show_analysis(self, view, vis_max_terms=None):
+        """
+        显示分析结果
+        :param view: 后台分析任务的结果
+        """
+        lda_model = view.get('model')
+        if isinstance(lda_model, str):
+            from gensim import models
+            lda_model = models.LdaModel.load(lda_model)
+        clusters = view['clusters']
+        if isinstance(clusters, str):
+            clusters = np.load(clusters)
+        X_pca = view['coords']
+        if isinstance(X_pca, str):
+            X_pca = np.load(X_pca)
+        texts = CompactCorpus.open(view['corpus']).view(view['sentiment'])
+        analyzer = CommentAnalyzer({'positive': [], 'negative': []}, {})
+        num_topics = lda_model.num_topics
         
-        # K-means聚类
-        kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-        clusters = kmeans.fit_predict(X)
+        # 显示LDA分析结果
+        st.subheader("LDA主题分析")
+        training = view.get('training')
+        if training:
+            reasons = {'converged': '已收敛', 'max_passes': '达到轮数上限', 'max_time': '达到时间上限'}
+            st.caption(f"训练 {training['passes']} 轮，{reasons.get(training['stop_reason'], '')}，"
+                       f"耗时 {training['elapsed_s']:.2f} 秒")
+        for idx, topic in lda_model.print_topics():
+            st.write(f'主题 {idx + 1}:')
+            st.write(topic)
         
-        # 获取每个聚类的关键词
-        cluster_keywords = []
-        for i in range(n_clusters):
-            center_vector = kmeans.cluster_centers_[i]
-            top_indices = center_vector.argsort()[-10:][::-1]
-            keywords = [vectorizer.get_feature_names_out()[idx] for idx in top_indices]
-            cluster_keywords.append(keywords)
+        # 显示LDA可视化（按模型指纹缓存，同一模型再次显示时无需重新计算）
+        html_string = analyzer.visualize(lda_model, texts, max_terms=vis_max_terms)
+        st.components.v1.html(html_string, height=800)
+        
+        # K-means聚类分析
+        st.subheader("K-means聚类分析")
+        
+        # 显示聚类结果
+        col1, col2 = st.columns([1, 2])  # 调整列宽比例
+        
+        with col1:
+            st.write("聚类关键词：")
+            for i, keywords in enumerate(view['cluster_keywords']):
+                st.write(f"聚类 {i + 1}: {', '.join(keywords[:5])}")
+        
+        with col2:
+            st.write("聚类散点图：")
+            fig = self.plot_cluster_scatter(X_pca, clusters, num_topics)
+            st.pyplot(fig)
+        
+        # 显示评论示例
+        st.subheader("评论示例")
+        df = texts.to_frame()
+        df['cluster'] = clusters
+        st.dataframe(df[['content', 'score', 'time', 'cluster']].head(10))
+    
+    def plot_cluster_scatter(self, X_pca, clusters, n_clusters, max_points=5000):
+        """绘制聚类散点图，评论很多时随机抽样max_points个点绘制"""
+        if len(clusters) > max_points:
+            sample = np.random.default_rng(42).choice(len(clusters), max_points, replace=False)
+            X_pca, clusters = X_pca[sample], clusters[sample]
+        
+        # matplotlib只在绘图时导入，加快页面首次加载
+        import matplotlib.pyplot as plt
         
-        return clusters, cluster_keywords, X_pca
-
-    def plot_cluster_scatter(self, X_pca, clusters, n_clusters):
-        """绘制聚类散点图"""
         plt.rcParams['font.sans-serif'] = ['SimHei']  # 用来正常显示中文
         plt.rcParams['axes.unicode_minus'] = False  # 用来正常显示负号
         
@@ -129,19 +297,38 @@ class StreamlitApp:
                 help="设置要爬取的差评数量"
             )
         
+        engine = st.radio(
+            "抓取方式",
+            ["http", "browser"],
+            format_func=lambda e: "HTTP并发抓取" if e == "http" else "浏览器逐页抓取",
+            horizontal=True
+        )
+        incremental = st.checkbox(
+            "增量抓取",
+            value=True,
+            help="只抓取新评论，并追加到该商品的 comments_<商品ID>.csv 中"
+        )
+        
+        runner = self.get_job_runner()
+        profile = st.sidebar.checkbox(
+            "记录cProfile",
+            help="为下一次爬取或分析保存cProfile数据，分析完成后在侧边栏查看耗时最多的函数"
+        )
+        
         if st.button("爬取评论"):
-            with st.spinner("正在爬取评论..."):
-                crawler = JDCommentCrawler()
-                csv_file = crawler.save_comments(
-                    product_id, 
-                    good_count=good_count,
-                    bad_count=bad_count
-                )
-                if csv_file:
-                    st.success(f"评论爬取完成！已保存至: {csv_file}")
-                    st.write(f"共爬取 {good_count + bad_count} 条评论（{good_count}条好评，{bad_count}条差评）")
-                else:
-                    st.error("爬取评论失败，请稍后重试")
+            # 爬取在后台任务中执行，页面不会被阻塞
+            job_id = runner.submit(
+                'crawl',
+                product_id=product_id,
+                good_count=int(good_count),
+                bad_count=int(bad_count),
+                engine=engine,
+                incremental=incremental,
+                profile=profile
+            )
+            st.success(f"已提交爬取任务 {job_id}，进度见下方任务列表")
+        
+        self.show_jobs(runner)
         
         # 选择已有的CSV文件进行分析
         if not os.path.exists('comments'):
@@ -153,12 +340,11 @@ class StreamlitApp:
             selected_file = st.selectbox("选择要分析的评论文件", csv_files)
             selected_file = os.path.join('comments', selected_file)
             
-            # 数据预处理
-            preprocessor = CommentPreprocessor()
-            processed_comments, comment_details = preprocessor.process_comments(selected_file)
+            # 数据预处理，结果保存为内存映射的紧凑语料
+            corpus = self.load_corpus(selected_file)
             
             # 分析器初始化
-            analyzer = CommentAnalyzer(processed_comments, comment_details)
+            analyzer = CommentAnalyzer.from_corpus(corpus)
             
             # 选择查看正面或负面评论
             analysis_type = st.radio(
@@ -167,60 +353,79 @@ class StreamlitApp:
             )
             
             num_topics = st.slider("选择主题数量", min_value=2, max_value=10, value=5)
+            workers = st.number_input(
+                "训练进程数",
+                min_value=1,
+                max_value=os.cpu_count() or 1,
+                value=os.cpu_count() or 1,
+                help="大于1时使用多进程LDA训练"
+            )
+            early_stopping = st.checkbox(
+                "收敛后提前停止训练",
+                value=True,
+                help="每轮训练后比较主题的变化，变化足够小时停止，最多训练20轮"
+            )
+            max_time = st.number_input(
+                "训练时间上限（秒）",
+                min_value=0,
+                value=0,
+                help="0为不限，仅在提前停止时生效"
+            )
+            
+            # 根据选择的评论类型获取相应的数据
+            texts = analyzer.positive if analysis_type == "正面评论" else analyzer.negative
+            sentiment = 'positive' if analysis_type == "正面评论" else 'negative'
+            
+            # 主题数扫描：在后台任务中并行训练2~10个主题的模型并缓存，之后切换主题数无需重新训练
+            sweeps = st.session_state.setdefault('topic_sweeps', {})
+            sweep_key = (selected_file, sentiment)
+            if st.button("扫描主题数", help="并行训练2~10个主题的模型，计算主题一致性并推荐主题数"):
+                if texts:
+                    job_id = runner.submit('sweep', file=selected_file, sentiment=sentiment,
+                                           workers=int(workers), profile=profile)
+                    st.success(f"已提交主题数扫描任务 {job_id}，完成后在任务列表中查看结果")
+            
+            if sweep_key in sweeps:
+                fingerprint, scores = sweeps[sweep_key]
+                st.line_chart(pd.Series(scores, name="主题一致性(u_mass)"))
+                st.info(f"推荐主题数：{TopicSweep.best_k(scores)}")
+            
+            vis_max_terms = st.select_slider(
+                "可视化词表上限",
+                options=[500, 1000, 2000, 5000, None],
+                value=2000,
+                format_func=lambda n: "不限" if n is None else str(n),
+                help="只用词频最高的词生成主题可视化，词表很大时可显著加快速度"
+            )
             
             if st.button("开始分析"):
-                with st.spinner("正在进行分析..."):
-                    # 根据选择的评论类型获取相应的数据
-                    texts = processed_comments['positive'] if analysis_type == "正面评论" else processed_comments['negative']
-                    details = comment_details['positive'] if analysis_type == "正面评论" else comment_details['negative']
-                    
-                    if not texts:
-                        st.warning(f"没有找到{analysis_type}数据")
-                        return
-                    
-                    # LDA主题分析
-                    lda_model, vis_data = analyzer.run_lda(texts, num_topics=num_topics)
-                    
-                    # 显示LDA分析结果
-                    st.subheader("LDA主题分析")
-                    for idx, topic in lda_model.print_topics():
-                        st.write(f'主题 {idx + 1}:')
-                        st.write(topic)
-                    
-                    # 显示LDA可视化
-                    temp_html = os.path.join(self.temp_dir, 'topics.html')
-                    pyLDAvis.save_html(vis_data, temp_html)
-                    with open(temp_html, 'r', encoding='utf-8') as f:
-                        html_string = f.read()
-                        st.components.v1.html(html_string, height=800)
-                    
-                    # K-means聚类分析
-                    st.subheader("K-means聚类分析")
-                    clusters, cluster_keywords, X_pca = self.perform_kmeans_analysis(
-                        texts, n_clusters=num_topics
-                    )
-                    
-                    # 显示聚类结果
-                    col1, col2 = st.columns([1, 2])  # 调整列宽比例
-                    
-                    with col1:
-                        st.write("聚类关键词：")
-                        for i, keywords in enumerate(cluster_keywords):
-                            st.write(f"聚类 {i + 1}: {', '.join(keywords[:5])}")
-                    
-                    with col2:
-                        st.write("聚类散点图：")
-                        fig = self.plot_cluster_scatter(X_pca, clusters, num_topics)
-                        st.pyplot(fig)
-                    
-                    # 显示评论示例
-                    st.subheader("评论示例")
-                    df = pd.DataFrame(details)
-                    df['cluster'] = clusters
-                    st.dataframe(df[['content', 'score', 'time', 'cluster']].head(10))
+                if not texts:
+                    st.warning(f"没有找到{analysis_type}数据")
+                    return
+                
+                # LDA和聚类在后台任务中执行，完成后在任务列表中查看结果；
+                # 已扫描过的主题数直接使用扫描中缓存的模型，只需聚类
+                job_id = runner.submit(
+                    'analysis',
+                    file=selected_file,
+                    sentiment=sentiment,
+                    num_topics=num_topics,
+                    workers=int(workers),
+                    early_stopping={'max_time': max_time or None} if early_stopping else None,
+                    sweep=sweeps[sweep_key][0] if sweep_key in sweeps else None,
+                    profile=profile
+                )
+                st.success(f"已提交分析任务 {job_id}，进度见上方任务列表")
+            
+            view = st.session_state.get('analysis_view')
+            if view:
+                self.show_analysis(view, vis_max_terms)
+            self.show_trends(product_id, sentiment)
+            self.show_metrics(view)
         
         else:
             st.info("请先爬取评论数据")
+            self.show_metrics()
 
 if __name__ == "__main__":
     app = StreamlitApp()
@@ -0,0 +1,340 @@
+"""
+多商品批处理
+
+对一批商品依次执行 爬取 → 预处理 → LDA主题分析/聚类：
+爬取是I/O密集的，用线程池并发抓取多个商品；预处理和训练是CPU密集的，
+每个商品爬完后立即提交到进程池分析。单个商品失败只记录错误，不影响其余商品。
+
+输出目录结构（每次运行覆盖同一商品的上次结果）：
+    <output>/<商品ID>/corpus/              紧凑语料
+    <output>/<商品ID>/analysis_<情感>.csv   评论详情
+    <output>/<商品ID>/topics_<情感>.txt     主题
+    <output>/<商品ID>/clusters_<情感>.json  聚类关键词和各聚类评论数
+    <output>/<商品ID>/result.json          该商品的运行结果
+    <output>/summary.json                 本次运行所有商品的汇总
+启用--trends时，评论还会按日期和主题计入 models/topic_trends.db（见topic_trends）。
+已有该商品保存的模型且记录的源文件相同时，只用新追加的评论在线更新模型（CommentAnalyzer.analyze_update），
+--retrain 强制重新训练。
+趋势沿用第一次登记的模型，重新训练不会重算历史评论；--reregister-trends 改用本次训练的模型。
+
+用法：
+    python batch.py 100012345678 100087654321 --engine http
+    python batch.py --ids-file skus.txt --skip-crawl
+"""
+import os
+import json
+import time
+import argparse
+import traceback
+import multiprocessing
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from jd_crawler import JDCommentCrawler
+from preprocess import CommentPreprocessor
+from corpus_store import CompactCorpus
+from analysis import CommentAnalyzer
+from topic_trends import TopicTrendIndex
+from clustering import CommentClusterer
+from seg_cache import SegmentationCache
+from instrumentation import metrics, configure_logging, profile_run
+
+
+def crawl_product(product_id, good_count=500, bad_count=500, engine='http', incremental=True, http_options=None):
+    """
+    爬取单个商品的评论（在线程中执行）
+    :return: 保存的CSV文件路径
+    """
+    with JDCommentCrawler(engine=engine, **(http_options or {})) as crawler:
+        csv_file = crawler.save_comments(product_id, good_count=good_count, bad_count=bad_count,
+                                         incremental=incremental)
+    if not csv_file:
+        raise RuntimeError("没有爬取到评论")
+    return os.path.join('comments', csv_file)
+
+
+def find_comments_file(product_id, comments_dir='comments'):
+    """找到商品已有的评论文件：优先使用增量文件，否则使用最新的带时间戳文件"""
+    incremental_file = os.path.join(comments_dir, f'comments_{product_id}.csv')
+    if os.path.exists(incremental_file):
+        return incremental_file
+    prefix = f'comments_{product_id}_'
+    if os.path.exists(comments_dir):
+        candidates = sorted(name for name in os.listdir(comments_dir)
+                            if name.startswith(prefix) and name.endswith('.csv'))
+        if candidates:
+            return os.path.join(comments_dir, candidates[-1])
+    return None
+
+
+def analyze_product(product_id, csv_file, output_dir, num_topics=5, n_clusters=None, random_state=42,
+                    metrics_log=None, profile=False, dedup=False, passes=20, early_stopping=None, trends=False,
+                    reregister_trends=False, retrain=False):
+    """
+    对单个商品做预处理、LDA主题分析和聚类（在工作进程中执行）
+    :param metrics_log: 各阶段指标的JSON日志文件
+    :param profile: 是否把cProfile数据保存到 <output>/<商品ID>/profile.prof
+    :param dedup: 是否合并重复和近似重复的评论后再建模
+    :param passes: LDA训练轮数（自适应训练时为上限）
+    :param early_stopping: 自适应训练的设置，见CommentAnalyzer.run_lda
+    :param trends: 是否更新主题趋势索引（沿用已登记的趋势模型）
+    :param reregister_trends: 是否改用本次训练的模型重新登记趋势模型
+    :param retrain: 已有保存的模型时是否仍然重新训练，默认只用新评论在线更新
+    :return: 该商品的结果摘要
+    """
+    product_dir = os.path.join(output_dir, str(product_id))
+    if not os.path.exists(product_dir):
+        os.makedirs(product_dir)
+    if metrics_log:
+        configure_logging(metrics_log)
+    mark = metrics.mark()
+    profile_path = os.path.join(product_dir, 'profile.prof') if profile else None
+    with profile_run(profile_path):
+        summary = _analyze_product(product_id, csv_file, product_dir, num_topics, n_clusters, random_state, dedup,
+                                   passes, early_stopping, trends, reregister_trends, retrain)
+    summary['metrics'] = metrics.summary(since=mark)
+    if profile_path:
+        summary['profile'] = profile_path
+    return summary
+
+
+def _analyze_product(product_id, csv_file, product_dir, num_topics, n_clusters, random_state, dedup=False,
+                     passes=20, early_stopping=None, trends=False, reregister_trends=False, retrain=False):
+    corpus_path = os.path.join(product_dir, 'corpus')
+    preprocessor = CommentPreprocessor(cache=SegmentationCache(), dedup=dedup)
+    try:
+        if not CompactCorpus.is_fresh(corpus_path, csv_file, dedup, preprocessor.fingerprint()):
+            CompactCorpus.from_file(preprocessor, csv_file, corpus_path)
+    finally:
+        preprocessor.close()
+    corpus = CompactCorpus.open(corpus_path)
+
+    analyzer = CommentAnalyzer.from_corpus(corpus, product_id=product_id)
+    mode = 'train' if retrain or not analyzer.can_update(csv_file, num_topics) else 'update'
+    if mode == 'update':
+        preprocessor = CommentPreprocessor(cache=SegmentationCache(), dedup=dedup)
+        try:
+            results = analyzer.analyze_update(preprocessor, csv_file, num_topics, random_state, product_dir)
+        finally:
+            preprocessor.close()
+    else:
+        results = analyzer.analyze(num_topics=num_topics, random_state=random_state, output_dir=product_dir,
+                                   passes=passes, early_stopping=early_stopping)
+
+    summary = {'comments': int(corpus.view().counts.sum()), 'mode': mode, 'sentiments': {}}
+    if 'dedup' in corpus.meta:
+        summary['dedup'] = corpus.meta['dedup']
+    for sentiment, result in results.items():
+        texts = corpus.view(sentiment)
+        clusters = {}
+        if len(texts) >= (n_clusters or num_topics):
+            clusterer = CommentClusterer(n_clusters=n_clusters or num_topics, random_state=random_state)
+            labels = clusterer.fit(texts)
+            # 与LDA模型保存在同一目录，供inference.TopicInferencer给新评论分配聚类
+            clusterer.save(os.path.join(analyzer.model_path(sentiment), 'clusterer.pkl'))
+            clusters = {
+                'keywords': clusterer.keywords_,
+                'sizes': np.bincount(labels, minlength=clusterer.n_clusters).tolist(),
+            }
+            with open(os.path.join(product_dir, f'clusters_{sentiment}.json'), 'w', encoding='utf-8') as f:
+                json.dump(clusters, f, ensure_ascii=False, indent=2)
+        summary['sentiments'][sentiment] = {
+            'comments': int(texts.counts.sum()),
+            'unique_comments': len(texts),
+            'topics': result['topics'],
+            'passes': result['passes'],
+            'training': result['training'],
+            'new_comments': result.get('new_comments'),
+            'file': result['file'],
+            'clusters': clusters.get('keywords'),
+        }
+    if trends and results:
+        index = TopicTrendIndex(os.path.join(analyzer.model_dir, 'topic_trends.db'))
+        try:
+            summary['trends'] = index.update_from_file(product_id, csv_file, analyzer.model_dir, list(results),
+                                                       reregister=reregister_trends)
+        finally:
+            index.close()
+    return summary
+
+
+def _write_json(path, data):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def run_batch(product_ids, output_dir='output', crawl=True, crawl_workers=4, analysis_workers=None,
+              num_topics=5, n_clusters=None, good_count=500, bad_count=500, engine='http',
+              incremental=True, http_options=None, metrics_log=None, profile=False, dedup=False,
+              passes=20, early_stopping=None, trends=False, reregister_trends=False, retrain=False):
+    """
+    批量处理多个商品
+    :param crawl: 为False时跳过爬取，直接分析comments/下已有的评论文件
+    :param crawl_workers: 同时爬取的商品数
+    :param analysis_workers: 分析进程数，默认使用全部CPU核心
+    :param metrics_log: 各阶段指标的JSON日志文件，爬取和分析进程都写入该文件
+    :param profile: 是否为每个商品的分析保存cProfile数据
+    :param dedup: 是否合并重复和近似重复的评论后再建模
+    :param passes: LDA训练轮数（自适应训练时为上限）
+    :param early_stopping: 自适应训练的设置，见CommentAnalyzer.run_lda
+    :param trends: 是否更新主题趋势索引（沿用已登记的趋势模型）
+    :param reregister_trends: 是否改用本次训练的模型重新登记趋势模型
+    :param retrain: 已有保存的模型时是否仍然重新训练，默认只用新评论在线更新
+    :return: {商品ID: 结果}，每个结果的status为'done'或'failed'
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    # 去重并保持输入顺序，保证输出确定
+    product_ids = list(dict.fromkeys(str(pid) for pid in product_ids))
+    report = {pid: {'status': 'pending'} for pid in product_ids}
+    start = time.time()
+    if metrics_log:
+        configure_logging(metrics_log)
+    mark = metrics.mark()
+
+    def fail(pid, stage, error):
+        print(f"商品{pid}在{stage}阶段失败: {error}")
+        report[pid] = {'status': 'failed', 'stage': stage, 'error': str(error),
+                       'traceback': ''.join(traceback.format_exception(type(error), error, error.__traceback__))}
+
+    # 分析进程在爬取线程运行期间创建，fork会把线程持有的锁（日志、sqlite、连接池）以加锁状态复制到子进程，
+    # 因此用spawn启动全新的解释器
+    with ProcessPoolExecutor(max_workers=analysis_workers or os.cpu_count(),
+                             mp_context=multiprocessing.get_context('spawn')) as analysis_pool:
+        analysis_futures = {}
+
+        def submit_analysis(pid, csv_file):
+            report[pid]['file'] = csv_file
+            future = analysis_pool.submit(analyze_product, pid, csv_file, output_dir, num_topics, n_clusters,
+                                          metrics_log=metrics_log, profile=profile, dedup=dedup,
+                                          passes=passes, early_stopping=early_stopping, trends=trends,
+                                          reregister_trends=reregister_trends, retrain=retrain)
+            analysis_futures[future] = pid
+
+        if crawl:
+            with ThreadPoolExecutor(max_workers=crawl_workers) as crawl_pool:
+                crawl_futures = {
+                    crawl_pool.submit(crawl_product, pid, good_count, bad_count, engine, incremental, http_options): pid
+                    for pid in product_ids
+                }
+                # 哪个商品先爬完就先分析哪个，爬取和分析互相重叠
+                for future in as_completed(crawl_futures):
+                    pid = crawl_futures[future]
+                    try:
+                        csv_file = future.result()
+                    except Exception as e:
+                        fail(pid, 'crawl', e)
+                        continue
+                    print(f"商品{pid}爬取完成: {csv_file}")
+                    submit_analysis(pid, csv_file)
+        else:
+            for pid in product_ids:
+                csv_file = find_comments_file(pid)
+                if csv_file is None:
+                    fail(pid, 'crawl', FileNotFoundError(f"没有找到商品{pid}的评论文件"))
+                else:
+                    submit_analysis(pid, csv_file)
+
+        for future in as_completed(analysis_futures):
+            pid = analysis_futures[future]
+            try:
+                summary = future.result()
+            except Exception as e:
+                fail(pid, 'analysis', e)
+                continue
+            report[pid].update(status='done', **summary)
+            _write_json(os.path.join(output_dir, pid, 'result.json'), report[pid])
+            print(f"商品{pid}分析完成")
+
+    _write_json(os.path.join(output_dir, 'summary.json'), {
+        'elapsed': round(time.time() - start, 2),
+        'done': sum(1 for r in report.values() if r['status'] == 'done'),
+        'failed': sum(1 for r in report.values() if r['status'] == 'failed'),
+        'crawl_metrics': metrics.summary(since=mark),
+        'requests': metrics.request_stats(since=mark),
+        'products': report,
+    })
+    return report
+
+
+def read_product_ids(path):
+    """读取商品ID文件：每行一个ID，忽略空行和#开头的注释"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='批量爬取并分析多个商品的评论')
+    parser.add_argument('product_ids', nargs='*', help='商品ID')
+    parser.add_argument('--ids-file', help='商品ID文件，每行一个')
+    parser.add_argument('--output', default='output', help='输出根目录')
+    parser.add_argument('--skip-crawl', action='store_true', help='不爬取，直接分析已有评论文件')
+    parser.add_argument('--engine', choices=['http', 'browser'], default='http', help='抓取引擎')
+    parser.add_argument('--full', action='store_true', help='全量爬取（默认增量爬取）')
+    parser.add_argument('--good-count', type=int, default=500)
+    parser.add_argument('--bad-count', type=int, default=500)
+    parser.add_argument('--crawl-workers', type=int, default=4, help='同时爬取的商品数')
+    parser.add_argument('--analysis-workers', type=int, default=None, help='分析进程数，默认全部CPU核心')
+    parser.add_argument('--num-topics', type=int, default=5)
+    parser.add_argument('--n-clusters', type=int, default=None, help='聚类数，默认等于主题数')
+    parser.add_argument('--base-url', default=None, help='评论接口地址（可指向jd_stub_server）')
+    parser.add_argument('--metrics-log', default=None, help='各阶段指标的JSON日志文件')
+    parser.add_argument('--profile', action='store_true', help='为每个商品的分析保存cProfile数据')
+    parser.add_argument('--dedup', action='store_true', help='合并重复和近似重复的评论后再建模')
+    parser.add_argument('--retrain', action='store_true', help='已有保存的模型时仍然重新训练')
+    parser.add_argument('--passes', type=int, default=20, help='LDA训练轮数，自适应训练时为上限')
+    parser.add_argument('--early-stopping', choices=['drift', 'perplexity'], default=None,
+                        help='按主题变化或困惑度判断收敛，收敛后提前停止训练')
+    parser.add_argument('--tol', type=float, default=None, help='收敛阈值，默认drift为0.02、perplexity为0.005')
+    parser.add_argument('--max-time', type=float, default=None, help='每个模型的训练时间预算（秒）')
+    parser.add_argument('--trends', action='store_true', help='把评论按日期和主题计入主题趋势索引')
+    parser.add_argument('--reregister-trends', action='store_true',
+                        help='改用本次训练的模型作为趋势模型，旧模型的趋势计数被删除')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    product_ids = list(args.product_ids)
+    if args.ids_file:
+        product_ids.extend(read_product_ids(args.ids_file))
+    if not product_ids:
+        print("请指定至少一个商品ID")
+        return 2
+
+    http_options = {'base_url': args.base_url} if args.base_url else None
+    early_stopping = None
+    if args.early_stopping:
+        early_stopping = {'metric': args.early_stopping, 'tol': args.tol, 'max_time': args.max_time}
+    report = run_batch(
+        product_ids,
+        output_dir=args.output,
+        crawl=not args.skip_crawl,
+        crawl_workers=args.crawl_workers,
+        analysis_workers=args.analysis_workers,
+        num_topics=args.num_topics,
+        n_clusters=args.n_clusters,
+        good_count=args.good_count,
+        bad_count=args.bad_count,
+        engine=args.engine,
+        incremental=not args.full,
+        http_options=http_options,
+        metrics_log=args.metrics_log,
+        profile=args.profile,
+        dedup=args.dedup,
+        passes=args.passes,
+        early_stopping=early_stopping,
+        trends=args.trends or args.reregister_trends,
+        reregister_trends=args.reregister_trends,
+        retrain=args.retrain,
+    )
+    failed = [pid for pid, r in report.items() if r['status'] != 'done']
+    print(f"完成 {len(report) - len(failed)}/{len(report)} 个商品")
+    if failed:
+        print(f"失败的商品: {', '.join(failed)}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
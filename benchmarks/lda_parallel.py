@@ -0,0 +1,65 @@
+"""
+单进程与多进程LDA训练的对比基准
+
+在仓库根目录运行：
+    python -m benchmarks.lda_parallel --workers 4
+默认使用comments/目录下全部快照合并后的语料，规模与实际抓取的数据相当。
+"""
+import os
+import time
+import argparse
+import numpy as np
+from preprocess import CommentPreprocessor
+from analysis import CommentAnalyzer
+
+
+def load_snapshot_texts(comments_dir='comments', repeat=1):
+    """合并comments/下全部快照的正面和负面分词结果"""
+    preprocessor = CommentPreprocessor()
+    texts = []
+    for name in sorted(os.listdir(comments_dir)):
+        if name.startswith('comments_') and name.endswith('.csv'):
+            processed, _ = preprocessor.process_comments(os.path.join(comments_dir, name))
+            texts.extend(processed['positive'] + processed['negative'])
+    return texts * repeat
+
+
+def topic_similarity(model_a, model_b):
+    """
+    两个模型主题的匹配程度：对model_a的每个主题取model_b中余弦相似度最高的主题，返回平均值
+    两个模型需使用相同的词典
+    """
+    a = model_a.get_topics()
+    b = model_b.get_topics()
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return float((a @ b.T).max(axis=1).mean())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='单进程与多进程LDA训练对比')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--num-topics', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=1, help='将语料重复若干倍以模拟更大的数据')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    texts = load_snapshot_texts(repeat=args.repeat)
+    analyzer = CommentAnalyzer({'positive': texts, 'negative': []}, {'positive': [], 'negative': []})
+    print(f'语料: {len(texts)} 条评论')
+
+    timings = {}
+    models = {}
+    for label, workers in (('single', 1), ('multicore', args.workers)):
+        start = time.perf_counter()
+        models[label], _ = analyzer.run_lda(texts, args.num_topics, workers=workers, random_state=args.seed,
+                                            with_vis=False)
+        timings[label] = time.perf_counter() - start
+        print(f'{label:>10} (workers={workers}): {timings[label]:.2f}s')
+
+    print(f'加速比: {timings["single"] / timings["multicore"]:.2f}x')
+    print(f'主题相似度: {topic_similarity(models["single"], models["multicore"]):.3f}')
+
+
+if __name__ == '__main__':
+    main()
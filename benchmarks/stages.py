@@ -0,0 +1,237 @@
+"""
+流水线各阶段的耗时与内存基准
+
+对每个语料规模，依次测量：
+    fetch_jsonp    从本地替身服务抓取评论页（HTTP + JSONP解析）
+    parse_jsonp    只解析已下载的JSONP文本
+    clean_text     清洗评论
+    segment        jieba分词
+    dictionary     构造corpora.Dictionary并转换为词袋
+    run_lda        训练LDA
+    ldavis         计算pyLDAvis数据
+    cluster        TF-IDF + SVD + KMeans聚类
+    save_results   save_analysis_results写出结果
+每个阶段记录墙钟时间、CPU时间（仅本进程）、tracemalloc峰值内存（单独再执行一次测得）、
+处理条数和吞吐量，
+报告以JSON保存在 benchmarks/results/<git提交>.json，便于不同提交之间比较。
+
+在仓库根目录运行：
+    python -m benchmarks.stages --rows 1000 10000 100000
+    python -m benchmarks.stages --rows 10000 --compare benchmarks/results/<旧提交>.json
+"""
+import os
+import gc
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+import requests
+import pandas as pd
+from gensim import corpora
+from benchmarks.synthetic import generate_corpus
+from jd_crawler import HTTPCommentFetcher, build_comment_params, parse_comment_page
+from jd_stub_server import StubCommentServer, build_canned_comments
+from preprocess import CommentPreprocessor
+from analysis import CommentAnalyzer
+from lda_vis import prepare_vis
+from clustering import CommentClusterer
+
+STAGES = ['fetch_jsonp', 'parse_jsonp', 'clean_text', 'segment', 'dictionary',
+          'run_lda', 'ldavis', 'cluster', 'save_results']
+RESULTS_DIR = os.path.join('benchmarks', 'results')
+
+
+def git_revision():
+    """当前的git提交和工作区是否有未提交的修改"""
+    try:
+        sha = subprocess.check_output(['git', 'rev-parse', '--short=12', 'HEAD'], text=True).strip()
+        dirty = bool(subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                             text=True).strip())
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return sha, dirty
+
+
+def measure(stage, fn, count, trace_memory=True):
+    """
+    执行fn并记录耗时和内存
+    tracemalloc会使纯Python的循环慢一个数量级，因此计时在不跟踪内存的情况下进行，
+    需要内存数据时再开启tracemalloc把fn重新执行一次取峰值
+    :param count: 处理条数，或根据fn的返回值计算条数的函数
+    :return: (fn的返回值, 测量记录)
+    """
+    gc.collect()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    result = fn()
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    peak = None
+    if trace_memory:
+        gc.collect()
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    items = count(result) if callable(count) else count
+    record = {
+        'stage': stage,
+        'wall_s': round(wall, 4),
+        'cpu_s': round(cpu, 4),
+        'peak_mb': round(peak, 2) if peak is not None else None,
+        'items': items,
+        'items_per_s': round(items / wall, 1) if wall > 0 else None,
+    }
+    print(f"  {stage:<13} {wall:9.3f}s  cpu {cpu:9.3f}s  "
+          f"peak {record['peak_mb'] if peak is not None else '-':>9} MB  {record['items_per_s']} 条/s")
+    return result, record
+
+
+def run_suite(rows, stages, num_topics=5, workers=1, fetch_limit=20000, vis_max_terms=None,
+              trace_memory=True, seed=42):
+    """对一个语料规模执行选中的阶段，返回各阶段的测量记录"""
+    csv_path = generate_corpus(rows, seed=seed)
+    df = pd.read_csv(csv_path, encoding='utf-8-sig')
+    contents = df['content'].astype(str).tolist()
+    records = []
+    state = {}
+
+    def run(stage, fn, count):
+        if stage in stages:
+            result, record = measure(stage, fn, count, trace_memory)
+            records.append(record)
+            return result
+        return fn()
+
+    if 'fetch_jsonp' in stages or 'parse_jsonp' in stages:
+        # 替身服务的数据规模有上限，抓取大语料时HTTP往返会淹没其他阶段
+        seeds = df[['content', 'score']].head(fetch_limit).to_dict('records')
+        comments = {3: build_canned_comments(seeds, len(seeds), 3, 1),
+                    1: build_canned_comments(seeds, len(seeds), 1, len(seeds) + 1)}
+        pages = range((len(seeds) + 99) // 100)
+        with StubCommentServer(comments, page_size=100) as server:
+            if 'fetch_jsonp' in stages:
+                fetcher = HTTPCommentFetcher(base_url=server.url, max_workers=4, rate=1e6)
+                try:
+                    run('fetch_jsonp', lambda: [page for score in (3, 1)
+                                                for page in fetcher.fetch_pages('bench', pages, score)],
+                        lambda result: sum(len(page) for page in result))
+                finally:
+                    fetcher.close()
+            if 'parse_jsonp' in stages:
+                session = requests.Session()
+                raw_pages = [session.get(server.url, params=build_comment_params('bench', page, score)).text
+                             for score in (3, 1) for page in pages]
+                session.close()
+                run('parse_jsonp', lambda: [parse_comment_page(text) for text in raw_pages],
+                    lambda result: sum(len(page) for page in result))
+
+    preprocessor = CommentPreprocessor(workers=workers)
+    # 加载jieba词典只发生一次，不计入分词阶段
+    preprocessor.segment('预热')
+    try:
+        cleaned = run('clean_text', lambda: [preprocessor.clean_text(text) for text in contents], len(contents))
+        cleaned = [text for text in cleaned if text]
+        texts = run('segment', lambda: preprocessor.segment_many(cleaned), len(cleaned))
+    finally:
+        preprocessor.close()
+    texts = [words for words in texts if words]
+
+    def build_dictionary():
+        dictionary = corpora.Dictionary(texts)
+        return dictionary, [dictionary.doc2bow(text) for text in texts]
+
+    if {'dictionary', 'ldavis'} & set(stages):
+        state['dictionary'], state['corpus'] = run('dictionary', build_dictionary, len(texts))
+
+    analyzer = CommentAnalyzer({'positive': texts, 'negative': []},
+                               {'positive': df[['content', 'score', 'time']].to_dict('records'), 'negative': []})
+    if {'run_lda', 'ldavis', 'save_results'} & set(stages):
+        state['lda'], _ = run('run_lda', lambda: analyzer.run_lda(texts, num_topics, workers=workers,
+                                                                  random_state=seed, with_vis=False), len(texts))
+    if 'ldavis' in stages:
+        run('ldavis', lambda: prepare_vis(state['lda'], state['corpus'], state['dictionary'],
+                                          max_terms=vis_max_terms), len(texts))
+    if 'cluster' in stages:
+        run('cluster', lambda: CommentClusterer(n_clusters=num_topics, random_state=seed).fit(texts), len(texts))
+    if 'save_results' in stages:
+        with tempfile.TemporaryDirectory() as output_dir:
+            topics = state['lda'].print_topics()
+            run('save_results', lambda: analyzer.save_analysis_results('positive', topics, output_dir), len(df))
+    return records
+
+
+def compare_reports(base, current):
+    """打印两份报告中相同规模、相同阶段的耗时和内存变化"""
+    print(f"\n对比 {base['commit']} -> {current['commit']}")
+    for rows, stages in current['runs'].items():
+        base_stages = base['runs'].get(rows, {})
+        for stage, record in stages.items():
+            old = base_stages.get(stage)
+            if not old:
+                continue
+            speedup = old['wall_s'] / record['wall_s'] if record['wall_s'] else float('inf')
+            memory = ''
+            if old.get('peak_mb') and record.get('peak_mb'):
+                memory = f"  内存 {record['peak_mb'] / old['peak_mb']:.2f}x"
+            print(f"  {rows:>8} {stage:<13} {old['wall_s']:9.3f}s -> {record['wall_s']:9.3f}s  "
+                  f"加速 {speedup:.2f}x{memory}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='流水线各阶段的耗时与内存基准')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--num-topics', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=1, help='分词和LDA训练的进程数')
+    parser.add_argument('--fetch-limit', type=int, default=20000, help='抓取阶段每个评分档的评论数上限')
+    parser.add_argument('--vis-max-terms', type=int, default=None)
+    parser.add_argument('--no-memory', action='store_true',
+                        help='不测量峰值内存，每个阶段只执行一次')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=None, help='报告路径，默认为benchmarks/results/<git提交>.json')
+    parser.add_argument('--compare', default=None, help='与之对比的旧报告')
+    args = parser.parse_args()
+
+    sha, dirty = git_revision()
+    report_path = args.output or os.path.join(RESULTS_DIR, f"{sha}{'-dirty' if dirty else ''}.json")
+    # 同一提交多次运行时合并结果，新结果覆盖同规模同阶段的旧结果
+    if os.path.exists(report_path):
+        with open(report_path, 'r', encoding='utf-8') as f:
+            report = json.load(f)
+    else:
+        report = {'commit': sha, 'dirty': dirty, 'runs': {}}
+    report.update({
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'config': {'num_topics': args.num_topics, 'workers': args.workers, 'seed': args.seed,
+                   'fetch_limit': args.fetch_limit, 'vis_max_terms': args.vis_max_terms,
+                   'trace_memory': not args.no_memory},
+    })
+
+    for rows in args.rows:
+        print(f'语料规模: {rows} 条')
+        records = run_suite(rows, args.stages, args.num_topics, args.workers, args.fetch_limit,
+                            args.vis_max_terms, not args.no_memory, args.seed)
+        report['runs'].setdefault(str(rows), {}).update({record['stage']: record for record in records})
+
+    directory = os.path.dirname(report_path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'报告已保存至: {report_path}')
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare_reports(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
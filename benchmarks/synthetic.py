@@ -0,0 +1,113 @@
+"""
+合成评论语料生成器
+
+以comments/下的真实快照为种子：把种子评论按标点切成短句，
+再从同一情感的短句中随机拼接出新评论，评分和时间按种子分布随机生成。
+词表和句长分布与真实数据接近，同时不会出现大量完全相同的评论。
+
+在仓库根目录运行：
+    python -m benchmarks.synthetic --rows 100000
+"""
+import os
+import re
+import argparse
+import numpy as np
+import pandas as pd
+
+DATA_DIR = os.path.join('benchmarks', 'data')
+
+_CLAUSE_SPLIT = re.compile(r'(?<=[，。！？；,.!?;\n])')
+
+
+def load_seeds(comments_dir='comments'):
+    """读取comments/下全部快照的评论内容和评分，去掉重复评论"""
+    frames = []
+    for name in sorted(os.listdir(comments_dir)):
+        if name.startswith('comments_') and name.endswith('.csv'):
+            df = pd.read_csv(os.path.join(comments_dir, name), encoding='utf-8-sig')
+            frames.append(df[['content', 'score']])
+    if not frames:
+        raise FileNotFoundError(f"{comments_dir}下没有评论快照")
+    seeds = pd.concat(frames, ignore_index=True).dropna().drop_duplicates('content')
+    seeds['score'] = seeds['score'].astype(int)
+    return seeds
+
+
+def _clauses(contents):
+    clauses = []
+    for content in contents:
+        clauses.extend(c.strip() for c in _CLAUSE_SPLIT.split(str(content)) if c.strip())
+    return np.array(clauses, dtype=object)
+
+
+def generate_frames(rows, seeds, seed=42, chunk_size=100000, max_clauses=4):
+    """
+    分块生成合成评论
+    :param seeds: load_seeds返回的种子评论
+    :param max_clauses: 每条评论最多由几个短句拼成
+    :return: 依次产生DataFrame（content, score, time）的生成器
+    """
+    rng = np.random.default_rng(seed)
+    positive = seeds['score'] >= 4
+    pools = {
+        True: (_clauses(seeds.loc[positive, 'content']), seeds.loc[positive, 'score'].to_numpy()),
+        False: (_clauses(seeds.loc[~positive, 'content']), seeds.loc[~positive, 'score'].to_numpy()),
+    }
+    # 某一情感没有种子时退回使用全部种子
+    for key, (clauses, scores) in pools.items():
+        if not len(clauses):
+            pools[key] = (_clauses(seeds['content']), np.array([5 if key else 1]))
+    positive_ratio = float(positive.mean())
+    end = np.datetime64('2025-01-01T00:00:00')
+
+    for start in range(0, rows, chunk_size):
+        n = min(chunk_size, rows - start)
+        is_positive = rng.random(n) < positive_ratio
+        lengths = rng.integers(1, max_clauses + 1, size=n)
+        content = np.empty(n, dtype=object)
+        score = np.empty(n, dtype=np.int64)
+        for flag in (True, False):
+            mask = is_positive == flag
+            clauses, scores = pools[flag]
+            picks = rng.integers(0, len(clauses), size=int(lengths[mask].sum()))
+            bounds = np.cumsum(lengths[mask])[:-1]
+            content[mask] = [''.join(parts) for parts in np.split(clauses[picks], bounds)]
+            score[mask] = rng.choice(scores, size=int(mask.sum()))
+        seconds = rng.integers(0, 365 * 24 * 3600, size=n)
+        times = (end - seconds.astype('timedelta64[s]')).astype(str)
+        yield pd.DataFrame({'content': content, 'score': score, 'time': np.char.replace(times, 'T', ' ')})
+
+
+def generate_corpus(rows, path=None, seed=42, comments_dir='comments'):
+    """
+    生成rows条合成评论并保存为与爬虫输出格式相同的CSV，已存在时直接复用
+    :return: CSV文件路径
+    """
+    path = path or os.path.join(DATA_DIR, f'synthetic_{rows}_s{seed}.csv')
+    if os.path.exists(path):
+        return path
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    seeds = load_seeds(comments_dir)
+    tmp_path = f'{path}.tmp'
+    first = True
+    for frame in generate_frames(rows, seeds, seed):
+        frame.to_csv(tmp_path, mode='w' if first else 'a', header=first, index=False,
+                     encoding='utf-8-sig' if first else 'utf-8')
+        first = False
+    os.replace(tmp_path, path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='根据真实评论快照生成合成评论语料')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    for rows in args.rows:
+        print(f'{rows:>8} 条: {generate_corpus(rows, seed=args.seed)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+评论聚类
+
+全程在稀疏TF-IDF矩阵上计算：TruncatedSVD降到2维用于可视化，
+MiniBatchKMeans分批聚类，聚类关键词一次性向量化提取。
+内存占用与非零元素数量成正比，不会把矩阵展开成稠密矩阵，可用于百万级评论。
+sklearn只在拟合或预测时才导入。
+"""
+import pickle
+import numpy as np
+from instrumentation import stage
+
+
+def _identity(doc):
+    # 评论已经分好词，直接使用分词结果作为特征
+    return doc
+
+
+class CommentClusterer:
+    def __init__(self, n_clusters=5, top_n=10, batch_size=4096, random_state=42):
+        """
+        :param n_clusters: 聚类数量
+        :param top_n: 每个聚类提取的关键词数量
+        :param batch_size: MiniBatchKMeans每批的样本数
+        """
+        self.n_clusters = n_clusters
+        self.top_n = top_n
+        self.batch_size = batch_size
+        self.random_state = random_state
+        self.vocabulary_ = None
+        self.feature_names_ = None
+        self.tfidf = None
+        self.svd = None
+        self.kmeans = None
+        self.labels_ = None
+        self.keywords_ = None
+        self.coords_ = None
+
+    def _count_matrix(self, texts, fit=False):
+        from sklearn.feature_extraction.text import CountVectorizer
+
+        if fit:
+            if hasattr(texts, 'term_matrix'):
+                # 紧凑语料已有词频矩阵，无需重新统计
+                counts, feature_names = texts.term_matrix()
+            else:
+                vectorizer = CountVectorizer(analyzer=_identity, dtype=np.float32)
+                counts = vectorizer.fit_transform(texts)
+                feature_names = vectorizer.get_feature_names_out()
+            self.feature_names_ = np.asarray(feature_names, dtype=object)
+            self.vocabulary_ = {term: i for i, term in enumerate(self.feature_names_)}
+            return counts
+        vectorizer = CountVectorizer(analyzer=_identity, vocabulary=self.vocabulary_, dtype=np.float32)
+        return vectorizer.transform(texts)
+
+    def fit(self, texts):
+        """
+        :param texts: 分词后的评论（列表、CommentStream或CorpusView）
+        :return: 每条评论的聚类标签
+        """
+        from sklearn.feature_extraction.text import TfidfTransformer
+        from sklearn.decomposition import TruncatedSVD
+        from sklearn.cluster import MiniBatchKMeans
+
+        with stage('tfidf') as record:
+            counts = self._count_matrix(texts, fit=True)
+            self.tfidf = TfidfTransformer()
+            X = self.tfidf.fit_transform(counts).astype(np.float32)
+            record['items'] = X.shape[0]
+            record['vocabulary'] = X.shape[1]
+
+        with stage('svd', items=X.shape[0]):
+            self.svd = TruncatedSVD(n_components=2, random_state=self.random_state)
+            self.coords_ = self.svd.fit_transform(X)
+
+        with stage('kmeans', items=X.shape[0], n_clusters=self.n_clusters):
+            self.kmeans = MiniBatchKMeans(
+                n_clusters=self.n_clusters,
+                batch_size=self.batch_size,
+                random_state=self.random_state,
+                n_init=3
+            )
+            self.labels_ = self.kmeans.fit_predict(X)
+            self.keywords_ = self.top_keywords()
+        return self.labels_
+
+    def transform(self, texts):
+        """新评论的TF-IDF矩阵（只使用训练时的词表）"""
+        return self.tfidf.transform(self._count_matrix(texts)).astype(np.float32)
+
+    def predict(self, texts):
+        """为新评论分配最近的聚类"""
+        return self.kmeans.predict(self.transform(texts))
+
+    def top_keywords(self, top_n=None):
+        """每个聚类中心权重最高的关键词"""
+        top_n = min(top_n or self.top_n, len(self.feature_names_))
+        centers = self.kmeans.cluster_centers_
+        if top_n < centers.shape[1]:
+            top = np.argpartition(-centers, top_n - 1, axis=1)[:, :top_n]
+        else:
+            top = np.tile(np.arange(centers.shape[1]), (centers.shape[0], 1))
+        order = np.argsort(-np.take_along_axis(centers, top, axis=1), axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        return self.feature_names_[top].tolist()
+
+    def __getstate__(self):
+        # 保存时不带训练数据的标签和坐标，模型文件大小与评论数量无关
+        state = self.__dict__.copy()
+        state['labels_'] = None
+        state['coords_'] = None
+        return state
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+
+def cluster_comments(texts, n_clusters=5, **kwargs):
+    """
+    对评论做K-means聚类
+    :return: 聚类标签、每个聚类的关键词、2维投影坐标
+    """
+    clusterer = CommentClusterer(n_clusters=n_clusters, **kwargs)
+    clusters = clusterer.fit(texts)
+    return clusters, clusterer.keywords_, clusterer.coords_
@@ -0,0 +1,385 @@
+"""
+紧凑的整数编码语料格式
+
+目录结构：
+    meta.json       文档数、词数、源文件、预处理配置指纹等元信息
+    vocab.json      词表，下标即词ID
+    tokens.bin      int32，所有文档的词ID首尾相接
+    offsets.bin     int64，第i篇文档的词ID为 tokens[offsets[i]:offsets[i+1]]
+    rows.bin        int64，文档在源文件中的行号
+    scores.bin      int8，评分
+    times.bin       datetime64[s]，评论时间（无法解析时为NaT）
+    sentiments.bin  int8，1为正面，-1为负面
+    counts.bin      int64，可选，启用去重时每篇文档代表的评论数（含自身）
+
+所有数组都以np.memmap打开，LDA、TF-IDF/KMeans和Streamlit应用可以
+共享同一份磁盘数据，打开的开销几乎为零。
+"""
+import os
+import json
+import shutil
+import tempfile
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from preprocess import load_content
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+SENTIMENT_CODES = {'positive': 1, 'negative': -1}
+
+_ARRAYS = {
+    'tokens': np.int32,
+    'offsets': np.int64,
+    'rows': np.int64,
+    'scores': np.int8,
+    'times': 'datetime64[s]',
+    'sentiments': np.int8,
+}
+
+
+def _write_counts(path, meta, counts, stats=None):
+    """写出counts.bin并在meta.json中记录去重统计"""
+    counts = np.asarray(counts, dtype=np.int64)
+    if len(counts) != meta['num_docs']:
+        raise ValueError(f"评论数数组长度 {len(counts)} 与文档数 {meta['num_docs']} 不一致")
+    with open(os.path.join(path, 'counts.bin'), 'wb') as f:
+        f.write(counts.tobytes())
+    meta['dedup'] = stats or {'comments': int(counts.sum()), 'unique': len(counts)}
+    with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+
+def _swap_dir(new_path, path):
+    """
+    用new_path整体替换path：旧目录先改名再删除，已打开的内存映射仍指向旧文件
+    两次改名之间path短暂不存在，读者应在CompactCorpus.locked内打开语料
+    """
+    old_path = None
+    if os.path.exists(path):
+        old_path = f'{new_path}.old'
+        os.rename(path, old_path)
+    os.rename(new_path, path)
+    if old_path:
+        shutil.rmtree(old_path, ignore_errors=True)
+
+
+class CompactCorpus:
+    def __init__(self, path, meta, vocab, arrays):
+        self.path = path
+        self.meta = meta
+        self.vocab = vocab
+        for name, array in arrays.items():
+            setattr(self, name, array)
+
+    @classmethod
+    def build(cls, records, path, source=None, batch_size=10000, progress=None, fingerprint=None, counts=None):
+        """
+        将预处理记录流写成紧凑语料，内存占用只与词表大小和batch_size有关
+        先写到同级的临时目录，写完后整体换到path，已打开旧语料的读者（np.memmap）不受影响
+        :param records: CommentPreprocessor.stream_comments产生的记录
+        :param source: 源文件路径，用于按行号取回评论原文
+        :param progress: 可选的回调progress(已写入的评论数)，每写完一批调用一次
+        :param fingerprint: 产生记录的预处理配置指纹（CommentPreprocessor.fingerprint），供is_fresh比较
+        :param counts: 可选的函数，在记录写完后调用，返回 (每篇文档代表的评论数, 去重统计)
+        """
+        parent = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+        tmp_path = tempfile.mkdtemp(prefix=f'.{os.path.basename(path)}.', dir=parent)
+        try:
+            meta = cls._write(records, tmp_path, source, batch_size, progress, fingerprint)
+            if counts:
+                _write_counts(tmp_path, meta, *counts())
+            _swap_dir(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                shutil.rmtree(tmp_path)
+        return cls.open(path)
+
+    @staticmethod
+    def _write(records, path, source, batch_size, progress, fingerprint):
+        token2id = {}
+        files = {name: open(os.path.join(path, f'{name}.bin'), 'wb') for name in _ARRAYS}
+        num_docs = 0
+        num_tokens = 0
+        batch = []
+
+        def flush():
+            nonlocal num_docs, num_tokens
+            lengths = np.fromiter((len(r['words']) for r in batch), dtype=np.int64, count=len(batch))
+            token_ids = np.fromiter(
+                (token2id.setdefault(w, len(token2id)) for r in batch for w in r['words']),
+                dtype=np.int32, count=int(lengths.sum())
+            )
+            times = pd.to_datetime(pd.Series([r['time'] for r in batch]), errors='coerce')
+            files['tokens'].write(token_ids.tobytes())
+            files['offsets'].write((num_tokens + np.cumsum(lengths)).tobytes())
+            files['rows'].write(np.array([r['row'] for r in batch], dtype=np.int64).tobytes())
+            files['scores'].write(np.array([r['score'] for r in batch], dtype=np.int8).tobytes())
+            files['times'].write(times.to_numpy(dtype='datetime64[s]').tobytes())
+            files['sentiments'].write(
+                np.array([SENTIMENT_CODES[r['sentiment']] for r in batch], dtype=np.int8).tobytes())
+            num_docs += len(batch)
+            num_tokens += len(token_ids)
+            if progress:
+                progress(num_docs)
+
+        try:
+            files['offsets'].write(np.zeros(1, dtype=np.int64).tobytes())
+            for record in records:
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    flush()
+                    batch = []
+            if batch:
+                flush()
+        finally:
+            for f in files.values():
+                f.close()
+
+        with open(os.path.join(path, 'vocab.json'), 'w', encoding='utf-8') as f:
+            json.dump(list(token2id), f, ensure_ascii=False)
+        meta = {
+            'num_docs': num_docs,
+            'num_tokens': num_tokens,
+            'vocab_size': len(token2id),
+            'source': source,
+            'source_mtime': os.path.getmtime(source) if source and os.path.exists(source) else None,
+            'fingerprint': fingerprint,
+        }
+        with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        return meta
+
+    @classmethod
+    def from_file(cls, preprocessor, file_path, path, read_chunk_size=10000, progress=None):
+        """
+        对源文件做流式预处理并写成紧凑语料
+        预处理器启用去重时，语料中只保留每组的代表评论，并写出各组的评论数
+        """
+        groups = []
+
+        def track(records):
+            for record in records:
+                if 'group' in record:
+                    groups.append(record['group'])
+                yield record
+
+        def counts():
+            index = preprocessor.dedup_index
+            return index.counts_of(groups), index.stats()
+
+        records = track(preprocessor.stream_comments(file_path, read_chunk_size))
+        return cls.build(records, path, source=file_path, batch_size=read_chunk_size, progress=progress,
+                         fingerprint=preprocessor.fingerprint(), counts=counts if preprocessor.dedup else None)
+
+    def write_counts(self, counts, stats=None):
+        """
+        保存每篇文档代表的评论数
+        :param stats: 写入meta['dedup']的去重统计
+        :return: 重新打开的语料
+        """
+        _write_counts(self.path, self.meta, counts, stats)
+        return self.open(self.path)
+
+    @staticmethod
+    @contextmanager
+    def locked(path):
+        """
+        path下语料的进程间排它锁（不支持fcntl的平台上不加锁）
+        检查是否过期、重建和打开都在锁内进行，同时分析同一文件的多个任务只重建一次
+        """
+        parent = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(parent):
+            os.makedirs(parent, exist_ok=True)
+        with open(f'{path}.lock', 'a') as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    @classmethod
+    def for_file(cls, file_path, make_preprocessor, root='corpus', read_chunk_size=10000, progress=None):
+        """
+        获取源文件对应的紧凑语料：不存在、源文件已更新或预处理配置（如停用词表）已变化时重新预处理，
+        否则直接打开
+        :param make_preprocessor: 返回CommentPreprocessor的函数
+        """
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        path = os.path.join(root, name)
+        preprocessor = make_preprocessor()
+        try:
+            with cls.locked(path):
+                if not cls.is_fresh(path, file_path, fingerprint=preprocessor.fingerprint()):
+                    cls.from_file(preprocessor, file_path, path, read_chunk_size, progress)
+                return cls.open(path)
+        finally:
+            preprocessor.close()
+
+    @classmethod
+    def open(cls, path):
+        """以内存映射方式打开语料"""
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        with open(os.path.join(path, 'vocab.json'), 'r', encoding='utf-8') as f:
+            vocab = np.array(json.load(f), dtype=object)
+        lengths = {'tokens': meta['num_tokens'], 'offsets': meta['num_docs'] + 1}
+        arrays = {}
+        for name, dtype in _ARRAYS.items():
+            length = lengths.get(name, meta['num_docs'])
+            if length == 0:
+                arrays[name] = np.zeros(0, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(os.path.join(path, f'{name}.bin'), dtype=dtype, mode='r', shape=(length,))
+        # 未去重的语料没有counts.bin，每篇文档只代表自身
+        arrays['counts'] = None
+        if 'dedup' in meta:
+            arrays['counts'] = (np.memmap(os.path.join(path, 'counts.bin'), dtype=np.int64, mode='r',
+                                          shape=(meta['num_docs'],))
+                                if meta['num_docs'] else np.zeros(0, dtype=np.int64))
+        return cls(path, meta, vocab, arrays)
+
+    @staticmethod
+    def is_fresh(path, source, dedup=None, fingerprint=None):
+        """
+        判断path下的语料是否存在且不旧于源文件
+        :param dedup: 为True/False时还要求语料是否去重与之一致，None时不检查
+        :param fingerprint: 当前的预处理配置指纹，指定时还要求与建语料时的一致，None时不检查
+        """
+        meta_path = os.path.join(path, 'meta.json')
+        if not os.path.exists(meta_path):
+            return False
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if dedup is not None and ('dedup' in meta) != dedup:
+            return False
+        if fingerprint is not None and meta.get('fingerprint') != fingerprint:
+            return False
+        return meta.get('source_mtime') == (os.path.getmtime(source) if source and os.path.exists(source) else None)
+
+    def __len__(self):
+        return self.meta['num_docs']
+
+    def view(self, sentiment=None):
+        """按情感取出子集视图，sentiment为None时为全部文档"""
+        if sentiment is None:
+            doc_ids = np.arange(len(self))
+        else:
+            doc_ids = np.flatnonzero(self.sentiments == SENTIMENT_CODES[sentiment])
+        return CorpusView(self, doc_ids)
+
+    def load_content(self, rows):
+        """按源文件行号取回评论原文"""
+        return load_content(self.meta.get('source'), rows)
+
+
+class CorpusView:
+    """
+    CompactCorpus中部分文档的视图
+
+    可以像分词列表一样迭代，也可以直接产出LDA和TF-IDF所需的稀疏输入，
+    避免重新构造词典和重新分词。
+    """
+
+    def __init__(self, corpus, doc_ids):
+        self.corpus = corpus
+        self.doc_ids = doc_ids
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __iter__(self):
+        vocab = self.corpus.vocab
+        offsets = self.corpus.offsets
+        tokens = self.corpus.tokens
+        for d in self.doc_ids:
+            yield vocab[tokens[offsets[d]:offsets[d + 1]]].tolist()
+
+    @property
+    def rows(self):
+        return self.corpus.rows[self.doc_ids]
+
+    @property
+    def scores(self):
+        return self.corpus.scores[self.doc_ids]
+
+    @property
+    def times(self):
+        return self.corpus.times[self.doc_ids]
+
+    @property
+    def counts(self):
+        """每篇文档代表的评论数，未去重的语料全部为1"""
+        if self.corpus.counts is None:
+            return np.ones(len(self.doc_ids), dtype=np.int64)
+        return self.corpus.counts[self.doc_ids]
+
+    def count_matrix(self):
+        """
+        文档-词频稀疏矩阵（列为全局词ID）
+        :return: scipy.sparse.csr_matrix，形状为 (文档数, 词表大小)
+        """
+        offsets = np.asarray(self.corpus.offsets)
+        starts = offsets[self.doc_ids]
+        lengths = offsets[self.doc_ids + 1] - starts
+        indptr = np.zeros(len(self.doc_ids) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        # 向量化地收集各文档的词ID：每个位置 = 所属文档起点 + 文档内偏移
+        positions = np.repeat(starts - indptr[:-1], lengths) + np.arange(indptr[-1])
+        indices = np.asarray(self.corpus.tokens)[positions]
+        matrix = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.float32), indices, indptr),
+            shape=(len(self.doc_ids), len(self.corpus.vocab))
+        )
+        matrix.sum_duplicates()
+        return matrix
+
+    def term_matrix(self):
+        """
+        去掉本视图中未出现的词后的文档-词频矩阵
+        :return: (csr_matrix, 对应的词列表)
+        """
+        matrix = self.count_matrix()
+        present = np.flatnonzero(matrix.getnnz(axis=0))
+        return matrix[:, present], self.corpus.vocab[present]
+
+    def lda_inputs(self):
+        """
+        直接由词ID数组构造gensim的词典和语料
+        :return: (corpora.Dictionary, 可重复迭代的词袋语料)
+        """
+        from gensim import corpora, matutils
+
+        matrix, terms = self.term_matrix()
+        dictionary = corpora.Dictionary()
+        dictionary.token2id = {term: i for i, term in enumerate(terms)}
+        dictionary.dfs = dict(enumerate(matrix.getnnz(axis=0).tolist()))
+        dictionary.cfs = dict(enumerate(np.asarray(matrix.sum(axis=0)).ravel().astype(np.int64).tolist()))
+        dictionary.num_docs = matrix.shape[0]
+        dictionary.num_pos = int(matrix.sum())
+        dictionary.num_nnz = int(matrix.nnz)
+        corpus = matutils.Sparse2Corpus(matrix.astype(np.int64), documents_columns=False)
+        return dictionary, corpus
+
+    def to_frame(self):
+        """
+        评论详情DataFrame（content、score、time），原文按行号从源文件取回
+        去重的语料另有count列，为每条代表评论所在组的评论数
+        """
+        rows = np.asarray(self.rows)
+        frame = pd.DataFrame({
+            'content': self.corpus.load_content(rows),
+            'score': np.asarray(self.scores),
+            'time': pd.Series(np.asarray(self.times)).dt.strftime('%Y-%m-%d %H:%M:%S'),
+        })
+        if self.corpus.counts is not None:
+            frame['count'] = np.asarray(self.counts)
+        return frame
@@ -0,0 +1,99 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+
+class CrawlStateStore:
+    """
+    基于SQLite的爬取状态存储
+
+    按 (商品ID, 评分档) 记录已见过的评论ID以及上次抓取到的页码，
+    使重复抓取只请求新评论，并能从中断处继续回补历史评论。
+    """
+
+    def __init__(self, db_path=os.path.join('comments', 'crawl_state.db')):
+        directory = os.path.dirname(db_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.db_path = db_path
+        # 好评和差评可能在不同线程中同时抓取，共用一个连接并加锁
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS seen_comments (
+                    product_id TEXT NOT NULL,
+                    score INTEGER NOT NULL,
+                    comment_id TEXT NOT NULL,
+                    PRIMARY KEY (product_id, score, comment_id)
+                ) WITHOUT ROWID
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS crawl_progress (
+                    product_id TEXT NOT NULL,
+                    score INTEGER NOT NULL,
+                    last_page INTEGER NOT NULL,
+                    complete INTEGER NOT NULL DEFAULT 0,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (product_id, score)
+                )
+            """)
+
+    def known_ids(self, product_id, score, comment_ids):
+        """返回comment_ids中已经抓取过的ID集合"""
+        comment_ids = [str(i) for i in comment_ids]
+        if not comment_ids:
+            return set()
+        known = set()
+        with self.lock:
+            # SQLite单条语句的参数数量有限，分批查询
+            for start in range(0, len(comment_ids), 500):
+                batch = comment_ids[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT comment_id FROM seen_comments "
+                    f"WHERE product_id = ? AND score = ? AND comment_id IN ({placeholders})",
+                    [str(product_id), score] + batch
+                ).fetchall()
+                known.update(row[0] for row in rows)
+        return known
+
+    def mark_seen(self, product_id, score, comment_ids):
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO seen_comments (product_id, score, comment_id) VALUES (?, ?, ?)",
+                [(str(product_id), score, str(i)) for i in comment_ids]
+            )
+
+    def seen_count(self, product_id, score):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT COUNT(*) FROM seen_comments WHERE product_id = ? AND score = ?",
+                (str(product_id), score)
+            ).fetchone()
+        return row[0]
+
+    def get_progress(self, product_id, score):
+        """
+        :return: (上次抓取到的页码, 是否已抓到列表末尾)，从未抓取时为 (-1, False)
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT last_page, complete FROM crawl_progress WHERE product_id = ? AND score = ?",
+                (str(product_id), score)
+            ).fetchone()
+        if row is None:
+            return -1, False
+        return row[0], bool(row[1])
+
+    def set_progress(self, product_id, score, last_page, complete):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO crawl_progress (product_id, score, last_page, complete, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (str(product_id), score, last_page, int(complete), datetime.now().isoformat(timespec='seconds'))
+            )
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,155 @@
+"""
+评论近似去重
+
+京东评论大量套用模板（"外形外观：… 加热速度：… 耗能情况：…"），快照之间也有许多完全相同
+或几乎相同的评论。NearDuplicateIndex 先按文本哈希合并完全相同的评论，再用MinHash签名和
+LSH分桶找出相似度超过阈值的评论，每组只保留第一条作为代表并记录组内评论数。
+
+索引是增量的：评论逐批加入，每条只与已有的代表比较，总耗时与评论数量成线性关系，
+可以在流式预处理中边读边去重。
+"""
+import hashlib
+import numpy as np
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+class NearDuplicateIndex:
+    def __init__(self, threshold=0.8, num_perm=64, bands=16, shingle_size=3, seed=42, batch_size=1000):
+        """
+        :param threshold: 判定为近似重复的Jaccard相似度阈值（按MinHash签名估计）
+        :param num_perm: MinHash签名长度，越长估计越准，越慢
+        :param bands: LSH分桶数，num_perm须能被整除；每桶行数越少，召回越高、候选越多
+        :param shingle_size: 按字符切分的n-gram长度
+        :param batch_size: 每次向量化计算签名的评论数，决定临时矩阵的大小
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm必须能被bands整除")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        self.batch_size = batch_size
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _MERSENNE_PRIME, size=(num_perm, 1), dtype=np.uint64)
+        self._b = rng.integers(0, _MERSENNE_PRIME, size=(num_perm, 1), dtype=np.uint64)
+
+        self.num_docs = 0
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+        self._exact = {}        # 文本哈希 -> 代表编号
+        self._buckets = {}      # (分区, 桶号, 桶内签名) -> 代表编号
+        self._signatures = {}   # 代表编号 -> MinHash签名
+        self.counts = {}        # 代表编号 -> 组内评论数
+
+    def __len__(self):
+        return self.num_docs
+
+    @property
+    def num_unique(self):
+        return len(self.counts)
+
+    def _shingle_hashes(self, text):
+        """字符n-gram的32位哈希，短于n的文本整体作为一个n-gram"""
+        codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+        n = self.shingle_size
+        if len(codes) < n:
+            codes = np.concatenate([codes, np.zeros(n - len(codes), dtype=np.uint64)])
+        hashes = np.zeros(len(codes) - n + 1, dtype=np.uint64)
+        for i, multiplier in enumerate((0x9E3779B1, 0x85EBCA77, 0xC2B2AE3D, 0x27D4EB2F)[:n]):
+            hashes ^= codes[i:len(codes) - n + 1 + i] * np.uint64(multiplier)
+        return np.unique(hashes & np.uint64(_MAX_HASH))
+
+    def signatures(self, texts):
+        """
+        批量计算MinHash签名：整批评论的n-gram拼在一起做一次置换哈希，再按评论分段取最小值
+        :return: (评论数, num_perm) 的uint32数组
+        """
+        result = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        for start in range(0, len(texts), self.batch_size):
+            shingles = [self._shingle_hashes(text) for text in texts[start:start + self.batch_size]]
+            lengths = np.array([len(s) for s in shingles])
+            hashes = np.concatenate(shingles)
+            permuted = (self._a * hashes + self._b) % np.uint64(_MERSENNE_PRIME)
+            starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+            result[start:start + len(shingles)] = (
+                np.minimum.reduceat(permuted, starts, axis=1).T & np.uint64(_MAX_HASH))
+        return result
+
+    def _band_keys(self, signature, partition):
+        rows = self.num_perm // self.bands
+        return [(partition, band, signature[band * rows:(band + 1) * rows].tobytes())
+                for band in range(self.bands)]
+
+    def add_many(self, texts, partitions=None):
+        """
+        加入一批评论
+        :param partitions: 每条评论的分区（如正面/负面），只在同一分区内判定重复，默认都在同一分区
+        :return: 每条评论所属组的代表编号；等于该评论自身编号（加入前的len(self)+下标）时即为新的代表
+        """
+        partitions = partitions if partitions is not None else [None] * len(texts)
+        groups = np.empty(len(texts), dtype=np.int64)
+
+        # 第一遍：完全相同的文本直接合并，剩下的才需要计算签名
+        pending = []
+        deferred = []
+        keys = []
+        for i, (text, partition) in enumerate(zip(texts, partitions)):
+            doc_id = self.num_docs + i
+            key = hashlib.blake2b(f'{partition}\x00{text}'.encode('utf-8'), digest_size=8).digest()
+            keys.append(key)
+            rep = self._exact.get(key)
+            if rep is None:
+                pending.append(i)
+                self._exact[key] = doc_id
+                groups[i] = doc_id
+            elif rep >= self.num_docs:
+                # 与同一批中前面的新文本相同，那一条的归属要到第二遍才能确定
+                deferred.append(i)
+            else:
+                groups[i] = rep
+                self.counts[rep] += 1
+                self.exact_duplicates += 1
+
+        # 第二遍：LSH找候选代表，签名相似度达到阈值才合并
+        signatures = self.signatures([texts[i] for i in pending]) if pending else []
+        for i, signature in zip(pending, signatures):
+            doc_id = self.num_docs + i
+            band_keys = self._band_keys(signature, partitions[i])
+            rep = None
+            for candidate in dict.fromkeys(self._buckets.get(key) for key in band_keys):
+                if candidate is not None and \
+                        np.mean(self._signatures[candidate] == signature) >= self.threshold:
+                    rep = candidate
+                    break
+            if rep is None:
+                self._signatures[doc_id] = signature
+                self.counts[doc_id] = 1
+                for key in band_keys:
+                    self._buckets.setdefault(key, doc_id)
+            else:
+                groups[i] = rep
+                self._exact[keys[i]] = rep
+                self.counts[rep] += 1
+                self.near_duplicates += 1
+        for i in deferred:
+            rep = self._exact[keys[i]]
+            groups[i] = rep
+            self.counts[rep] += 1
+            self.exact_duplicates += 1
+
+        self.num_docs += len(texts)
+        return groups
+
+    def counts_of(self, groups):
+        """各代表当前的组内评论数"""
+        return np.array([self.counts[group] for group in groups], dtype=np.int64)
+
+    def stats(self):
+        return {
+            'comments': self.num_docs,
+            'unique': self.num_unique,
+            'exact_duplicates': self.exact_duplicates,
+            'near_duplicates': self.near_duplicates,
+        }
@@ -0,0 +1,212 @@
+"""
+新评论的主题推断
+
+TopicInferencer 一次性加载训练好的LDA模型、词典和（可选的）聚类模型并常驻内存，
+对成批的原始评论复用CommentPreprocessor清洗分词，然后在整批评论的稀疏词频矩阵上
+用numpy同时做变分推断，得到每条评论的主题分布和最近的聚类，无需重新训练。
+
+    inferencer = TopicInferencer.for_product('100104067842', 'negative')
+    result = inferencer.infer(['热水器加热很慢，客服也不回复'])
+    result['topics']      # (评论数, 主题数) 的主题分布
+    inferencer.latency_stats()
+
+也可从命令行对标准输入中的评论（每行一条）逐批打标签：
+    python inference.py 100104067842 negative < new_comments.txt
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from collections import deque
+import numpy as np
+from scipy import sparse
+from scipy.special import psi
+from preprocess import CommentPreprocessor
+from clustering import CommentClusterer
+from instrumentation import stage
+
+
+def batch_inference(lda_model, matrix, iterations=None, threshold=None):
+    """
+    对整批文档同时做LDA的变分推断（E步），与LdaModel.inference的更新公式相同，
+    但每轮迭代是几次矩阵运算，而不是逐条文档的Python循环
+    :param matrix: (文档数, 词表大小) 的csr词频矩阵，列与模型的词典一致
+    :param iterations: 最大迭代次数，默认与模型训练时相同
+    :param threshold: 每条文档gamma平均变化量的收敛阈值，默认与模型训练时相同
+    :return: (文档数, 主题数) 的gamma（未归一化的主题分布）
+    """
+    iterations = iterations or lda_model.iterations
+    threshold = threshold or lda_model.gamma_threshold
+    alpha = np.asarray(lda_model.alpha, dtype=np.float64)
+    exp_elog_beta = np.asarray(lda_model.expElogbeta, dtype=np.float64)
+    num_docs, num_topics = matrix.shape[0], len(alpha)
+
+    matrix = sparse.csr_matrix(matrix, dtype=np.float64)
+    matrix.sum_duplicates()
+    rows = np.repeat(np.arange(num_docs), np.diff(matrix.indptr))
+    counts = matrix.data
+    # 每个非零元素对应的 exp(E[log beta])，形状为 (非零元素数, 主题数)
+    beta_nz = exp_elog_beta[:, matrix.indices].T
+    weights = sparse.csr_matrix((np.empty_like(counts), matrix.indices, matrix.indptr), shape=matrix.shape)
+
+    # 确定性的初始化：先验加上按主题均分的文档长度
+    lengths = np.asarray(matrix.sum(axis=1)).ravel()
+    gamma = alpha + (lengths / num_topics)[:, None]
+    for _ in range(iterations):
+        exp_elog_theta = np.exp(psi(gamma) - psi(gamma.sum(axis=1, keepdims=True)))
+        phinorm = np.einsum('ij,ij->i', exp_elog_theta[rows], beta_nz) + 1e-100
+        weights.data = counts / phinorm
+        new_gamma = alpha + exp_elog_theta * (weights @ exp_elog_beta.T)
+        change = np.abs(new_gamma - gamma).mean(axis=1)
+        gamma = new_gamma
+        if change.max(initial=0.0) < threshold:
+            break
+    return gamma
+
+
+class TopicInferencer:
+    def __init__(self, lda_model, clusterer=None, preprocessor=None, latency_window=10000):
+        """
+        :param lda_model: 训练好的LDA模型，lda_model.id2word为其词典
+        :param clusterer: 可选的CommentClusterer，用于给新评论分配最近的聚类
+        :param preprocessor: 清洗和分词使用的CommentPreprocessor，默认新建一个单进程的
+        :param latency_window: 计算延迟分位数时保留的最近批次数
+        """
+        self.lda_model = lda_model
+        self.dictionary = lda_model.id2word
+        self.token2id = self.dictionary.token2id
+        self.clusterer = clusterer
+        self.preprocessor = preprocessor or CommentPreprocessor()
+        self._latencies = deque(maxlen=latency_window)
+        # 提前加载jieba词典，避免第一批评论的延迟里包含词典加载时间
+        self.preprocessor.segment('预热')
+
+    @classmethod
+    def load(cls, model_dir, clusterer_path=None, **kwargs):
+        """
+        从目录加载模型：lda.model、dictionary.dict（CommentAnalyzer.save_model的输出），
+        以及可选的clusterer.pkl
+        """
+        from gensim import corpora, models
+
+        lda_model = models.LdaModel.load(os.path.join(model_dir, 'lda.model'))
+        lda_model.id2word = corpora.Dictionary.load(os.path.join(model_dir, 'dictionary.dict'))
+        clusterer_path = clusterer_path or os.path.join(model_dir, 'clusterer.pkl')
+        clusterer = CommentClusterer.load(clusterer_path) if os.path.exists(clusterer_path) else None
+        return cls(lda_model, clusterer, **kwargs)
+
+    @classmethod
+    def for_product(cls, product_id, sentiment, model_dir='models', **kwargs):
+        """加载某个商品某一情感的模型，目录结构与CommentAnalyzer.model_path一致"""
+        return cls.load(os.path.join(model_dir, str(product_id), sentiment), **kwargs)
+
+    def tokenize(self, texts):
+        """清洗并分词，清洗后为空的评论得到空列表"""
+        cleaned = [self.preprocessor.clean_text(str(text)) for text in texts]
+        present = [i for i, text in enumerate(cleaned) if text]
+        tokens = [[] for _ in cleaned]
+        for i, words in zip(present, self.preprocessor.segment_many([cleaned[i] for i in present])):
+            tokens[i] = words
+        return tokens
+
+    def term_matrix(self, tokens):
+        """分词结果转换为模型词典上的词频矩阵，词典外的词被忽略"""
+        indptr = [0]
+        indices = []
+        for words in tokens:
+            indices.extend(self.token2id[w] for w in words if w in self.token2id)
+            indptr.append(len(indices))
+        data = np.ones(len(indices), dtype=np.float64)
+        matrix = sparse.csr_matrix((data, indices, indptr), shape=(len(tokens), self.lda_model.num_terms))
+        matrix.sum_duplicates()
+        return matrix
+
+    def infer_tokens(self, tokens):
+        """
+        对已分词的评论做推断
+        :return: 字典，包含
+                 topics: (评论数, 主题数) 的主题分布，没有已知词的评论为先验分布
+                 top_topic: 概率最大的主题编号
+                 known_terms: 每条评论在词典中的词数
+                 cluster: 最近的聚类编号，未加载聚类模型时为None
+        """
+        matrix = self.term_matrix(tokens)
+        gamma = batch_inference(self.lda_model, matrix)
+        topics = gamma / gamma.sum(axis=1, keepdims=True)
+        result = {
+            'topics': topics.astype(np.float32),
+            'top_topic': topics.argmax(axis=1),
+            'known_terms': np.asarray(matrix.sum(axis=1)).ravel().astype(np.int64),
+            'cluster': None,
+        }
+        if self.clusterer is not None and len(tokens):
+            result['cluster'] = self.clusterer.predict(tokens)
+        return result
+
+    def infer(self, texts):
+        """对一批原始评论做清洗、分词和推断，记录本批的延迟"""
+        texts = list(texts)
+        start = time.perf_counter()
+        with stage('inference', items=len(texts)):
+            result = self.infer_tokens(self.tokenize(texts))
+        self._latencies.append((time.perf_counter() - start, len(texts)))
+        return result
+
+    def tag_stream(self, texts, batch_size=256):
+        """
+        对评论流逐批推断，按输入顺序逐条产出结果
+        :return: 生成器，每条为 {'text', 'topic', 'topics', 'cluster'}
+        """
+        batch = []
+
+        def flush():
+            result = self.infer(batch)
+            for i, text in enumerate(batch):
+                yield {
+                    'text': text,
+                    'topic': int(result['top_topic'][i]),
+                    'topics': [round(float(p), 4) for p in result['topics'][i]],
+                    'cluster': int(result['cluster'][i]) if result['cluster'] is not None else None,
+                }
+
+        for text in texts:
+            batch.append(text)
+            if len(batch) >= batch_size:
+                yield from flush()
+                batch = []
+        if batch:
+            yield from flush()
+
+    def latency_stats(self):
+        """最近各批次的延迟分位数（毫秒）和吞吐量（条/秒）"""
+        if not self._latencies:
+            return {'batches': 0}
+        latencies = np.array([latency for latency, _ in self._latencies])
+        comments = sum(size for _, size in self._latencies)
+        return {
+            'batches': len(latencies),
+            'comments': comments,
+            'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 2),
+            'p99_ms': round(float(np.percentile(latencies, 99)) * 1000, 2),
+            'comments_per_s': round(comments / float(latencies.sum()), 1) if latencies.sum() > 0 else None,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='对新评论推断主题，每行输出一个JSON')
+    parser.add_argument('product_id')
+    parser.add_argument('sentiment', choices=['positive', 'negative'])
+    parser.add_argument('--model-dir', default='models')
+    parser.add_argument('--batch-size', type=int, default=256)
+    args = parser.parse_args()
+
+    inferencer = TopicInferencer.for_product(args.product_id, args.sentiment, args.model_dir)
+    lines = (line.rstrip('\n') for line in sys.stdin if line.strip())
+    for tagged in inferencer.tag_stream(lines, args.batch_size):
+        print(json.dumps(tagged, ensure_ascii=False))
+    print(json.dumps(inferencer.latency_stats(), ensure_ascii=False), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""
+流水线埋点与性能分析
+
+各阶段用 stage() 包裹，记录墙钟时间、CPU时间、进程内存峰值及本阶段对峰值的抬高量、处理条数和吞吐量；
+爬虫的每个请求用 record_request() 记录延迟和重试次数。
+每条记录以一行JSON写入日志 'jd_comment_lda.metrics'，同时保留在内存中供页面展示。
+profile_run() 可为任意一次运行保存cProfile数据。
+
+    from instrumentation import stage
+    with stage('segment') as record:
+        words = preprocessor.segment_many(texts)
+        record['items'] = len(texts)
+"""
+import os
+import sys
+import json
+import time
+import logging
+import cProfile
+import pstats
+import io
+import threading
+from collections import deque, defaultdict
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows没有resource模块，不记录内存峰值
+    resource = None
+
+logger = logging.getLogger('jd_comment_lda.metrics')
+
+
+def peak_rss_mb():
+    """进程启动以来的最大常驻内存（MB），不支持的平台返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux的单位为KB，macOS为字节
+    return peak / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+
+
+def _emit(record, level=logging.INFO):
+    if logger.isEnabledFor(level):
+        logger.log(level, json.dumps(record, ensure_ascii=False, default=str))
+
+
+class MetricsRecorder:
+    """线程安全的指标收集器，只保留最近的记录"""
+
+    def __init__(self, max_records=1000, max_requests=10000):
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._records = deque(maxlen=max_records)
+        self._requests = deque(maxlen=max_requests)
+
+    def _next_seq(self):
+        with self._lock:
+            self._seq += 1
+            return self._seq
+
+    @contextmanager
+    def stage(self, name, **fields):
+        """
+        记录一个阶段的耗时和资源占用
+        CPU时间为整个进程的CPU时间（多线程同时运行的阶段会互相计入），不含子进程
+        :param fields: 附加到记录中的字段，如商品ID、主题数等
+        :return: 上下文管理器，产出记录字典，可在阶段内设置 record['items']
+        """
+        record = {'event': 'stage', 'stage': name, 'items': None}
+        record.update(fields)
+        rss_before = peak_rss_mb()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+            record['status'] = 'ok'
+        except BaseException as e:
+            record['status'] = 'error'
+            record['error'] = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            wall = time.perf_counter() - wall_start
+            record['wall_s'] = round(wall, 4)
+            record['cpu_s'] = round(time.process_time() - cpu_start, 4)
+            rss_after = peak_rss_mb()
+            if rss_after is not None:
+                record['peak_rss_mb'] = round(rss_after, 1)
+                # 大于0说明该阶段抬高了进程的内存峰值
+                record['rss_growth_mb'] = round(rss_after - rss_before, 1)
+            if record['items'] is not None and wall > 0:
+                record['items_per_s'] = round(record['items'] / wall, 1)
+            record['time'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+            record['seq'] = self._next_seq()
+            with self._lock:
+                self._records.append(record)
+            _emit(record)
+
+    def record_request(self, latency, retries=0, ok=True, **fields):
+        """
+        记录一次页面请求
+        :param latency: 最后一次尝试的耗时（秒）
+        :param retries: 重试次数
+        """
+        record = {'event': 'request', 'latency_ms': round(latency * 1000, 1), 'retries': retries, 'ok': ok}
+        record.update(fields)
+        record['seq'] = self._next_seq()
+        with self._lock:
+            self._requests.append(record)
+        _emit(record, logging.DEBUG)
+
+    def mark(self):
+        """当前的记录序号，配合since参数只取之后产生的记录"""
+        with self._lock:
+            return self._seq
+
+    def records(self, since=0):
+        with self._lock:
+            return [dict(r) for r in self._records if r['seq'] > since]
+
+    def summary(self, since=0):
+        """
+        按阶段汇总：次数、总耗时、总CPU时间、总条数、吞吐量和内存
+        rss_growth_mb为该阶段各次调用抬高进程内存峰值的总量，是归属于该阶段的内存开销；
+        peak_rss_mb是该阶段结束时整个进程自启动以来的峰值，可能来自之前更耗内存的阶段
+        """
+        totals = defaultdict(lambda: {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'items': 0,
+                                      'rss_growth_mb': None, 'peak_rss_mb': None})
+        for record in self.records(since):
+            total = totals[record['stage']]
+            total['calls'] += 1
+            total['wall_s'] += record['wall_s']
+            total['cpu_s'] += record['cpu_s']
+            total['items'] += record['items'] or 0
+            if record.get('peak_rss_mb') is not None:
+                total['peak_rss_mb'] = max(total['peak_rss_mb'] or 0, record['peak_rss_mb'])
+                total['rss_growth_mb'] = round((total['rss_growth_mb'] or 0) + record['rss_growth_mb'], 1)
+        result = {}
+        for name, total in totals.items():
+            total['wall_s'] = round(total['wall_s'], 4)
+            total['cpu_s'] = round(total['cpu_s'], 4)
+            total['items_per_s'] = round(total['items'] / total['wall_s'], 1) if total['wall_s'] else None
+            result[name] = total
+        return result
+
+    def request_stats(self, since=0):
+        """请求数、失败数、重试次数和延迟分位数"""
+        with self._lock:
+            requests = [r for r in self._requests if r['seq'] > since]
+        if not requests:
+            return {'requests': 0}
+        latencies = np.array([r['latency_ms'] for r in requests])
+        return {
+            'requests': len(requests),
+            'failures': sum(1 for r in requests if not r['ok']),
+            'retries': sum(r['retries'] for r in requests),
+            'p50_ms': round(float(np.percentile(latencies, 50)), 1),
+            'p95_ms': round(float(np.percentile(latencies, 95)), 1),
+            'max_ms': round(float(latencies.max()), 1),
+        }
+
+    def reset(self):
+        with self._lock:
+            self._records.clear()
+            self._requests.clear()
+
+
+# 每个进程一个全局收集器
+metrics = MetricsRecorder()
+stage = metrics.stage
+record_request = metrics.record_request
+
+
+def configure_logging(path=None, level=logging.INFO):
+    """
+    把指标日志输出到文件（每行一个JSON对象），path为None时输出到标准错误
+    同一进程中重复配置同一个文件时不会重复输出
+    :param level: logging.DEBUG时同时输出每个请求的记录
+    """
+    logger.setLevel(level)
+    if path:
+        for handler in logger.handlers:
+            if getattr(handler, 'baseFilename', None) == os.path.abspath(path):
+                return handler
+    handler = logging.FileHandler(path, encoding='utf-8') if path else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.propagate = False
+    return handler
+
+
+@contextmanager
+def profile_run(path=None):
+    """
+    用cProfile分析一段代码，结束后把统计数据保存到path（可用snakeviz等工具查看）
+    path为None时不做分析，便于按开关启用；只分析当前线程，线程池和子进程中的代码不会被记录
+    """
+    if path is None:
+        yield None
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+
+
+def profile_summary(path, limit=20, sort='cumulative'):
+    """读取cProfile数据，返回耗时最多的函数的文本报表"""
+    output = io.StringIO()
+    pstats.Stats(path, stream=output).sort_stats(sort).print_stats(limit)
+    return output.getvalue()
@@ -4,17 +4,196 @@ import json
 import pandas as pd
 from datetime import datetime
 import os
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
 import requests
+import threading
+from crawl_state import CrawlStateStore
+from instrumentation import stage, record_request
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+COMMENT_URL = 'https://club.jd.com/comment/productPageComments.action'
+JSONP_CALLBACK = 'fetchJSON_comment98'
+
+# 评论接口的排序方式：5为推荐排序，6为按时间倒序（增量抓取依赖时间序）
+SORT_RECOMMENDED = 5
+SORT_BY_TIME = 6
+
+
+def build_comment_params(product_id, page, score, sort_type=SORT_RECOMMENDED):
+    """构造评论接口的查询参数"""
+    return {
+        'callback': JSONP_CALLBACK,
+        'productId': product_id,
+        'score': score,
+        'sortType': sort_type,
+        'page': page,
+        'pageSize': 100,
+        'isShadowSku': 0,
+        'fold': 1,
+        'rid': 0,
+        'sku': product_id,
+    }
+
+
+def parse_comment_page(response_text):
+    """
+    解析JSONP格式的评论页
+    :param response_text: 接口返回的文本（或浏览器的page_source）
+    :return: 评论列表，无法解析时返回None
+    """
+    if f'{JSONP_CALLBACK}(' not in response_text:
+        return None
+    json_text = response_text.split(f'{JSONP_CALLBACK}(')[1].split(');')[0]
+    result = json.loads(json_text)
+    return result.get('comments') or []
+
+
+def to_record(comment, comment_type):
+    """将接口返回的评论转换为保存用的记录"""
+    return {
+        'content': comment['content'],
+        'score': comment['score'],
+        'time': comment['creationTime'],
+        'type': comment_type,
+        'id': comment.get('id')
+    }
+
+
+class TokenBucket:
+    """线程安全的令牌桶限速器"""
+    
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: 每秒补充的令牌数（即平均请求速率）
+        :param capacity: 桶容量（允许的突发请求数），默认与rate相同
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        """取出一个令牌，令牌不足时阻塞等待"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class HTTPCommentFetcher:
+    """基于HTTP连接池的并发评论抓取引擎"""
+    
+    def __init__(self, base_url=COMMENT_URL, max_workers=4, rate=2.0, burst=None,
+                 max_retries=3, backoff=1.0, timeout=10):
+        """
+        :param base_url: 评论接口地址，测试时可指向本地的替身服务
+        :param max_workers: 并发请求的线程数
+        :param rate: 令牌桶限速，每秒最多发起的请求数
+        :param burst: 令牌桶容量，默认等于max_workers
+        :param max_retries: 单页请求失败后的最大重试次数
+        :param backoff: 指数退避的基础等待秒数
+        :param timeout: 单次请求超时秒数
+        """
+        self.base_url = base_url
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.limiter = TokenBucket(rate, burst if burst is not None else max_workers)
+        
+        # 复用keep-alive连接，连接池大小与并发数一致
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                          '(KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+            'Referer': 'https://item.jd.com/'
+        })
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+    
+    def fetch_page(self, product_id, page, score, sort_type=SORT_RECOMMENDED):
+        """抓取单页评论，失败时按指数退避重试"""
+        params = build_comment_params(product_id, page, score, sort_type)
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            start = time.perf_counter()
+            try:
+                response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+                if response.status_code == 429 or response.status_code >= 500:
+                    raise requests.HTTPError(f"HTTP {response.status_code}")
+                response.raise_for_status()
+                comments = parse_comment_page(response.text)
+                if comments is None:
+                    raise ValueError("响应不是有效的JSONP评论页")
+                record_request(time.perf_counter() - start, attempt, True, engine='http', page=page, score=score)
+                return comments
+            except (requests.RequestException, ValueError) as e:
+                if attempt == self.max_retries:
+                    record_request(time.perf_counter() - start, attempt, False, engine='http', page=page,
+                                   score=score, error=str(e))
+                    print(f"获取评论出错: {str(e)}")
+                    return []
+                time.sleep(self.backoff * (2 ** attempt) + random.uniform(0, self.backoff))
+        return []
+    
+    def fetch_pages(self, product_id, pages, score, sort_type=SORT_RECOMMENDED):
+        """并发抓取多页评论，结果按页码顺序返回"""
+        futures = [self.executor.submit(self.fetch_page, product_id, page, score, sort_type) for page in pages]
+        return [future.result() for future in futures]
+    
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
 
 class JDCommentCrawler:
-    def __init__(self):
+    def __init__(self, engine='browser', **http_options):
+        """
+        :param engine: 抓取引擎，'browser'使用无头Chrome，'http'直接请求评论接口
+        :param http_options: 传给HTTPCommentFetcher的参数（并发数、限速、重试等）
+        
+        浏览器在第一次抓取页面时才启动，之后多次调用save_comments都复用同一个浏览器，
+        用完后调用close()关闭，或使用 with JDCommentCrawler() as crawler: 的形式
+        """
+        self.engine = engine
+        self.http_options = http_options
+        self.driver = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def close(self):
+        """关闭浏览器（如果已启动）"""
+        if self.driver is not None:
+            self.driver.quit()
+            self.driver = None
+    
+    def _get_driver(self):
+        if self.driver is None:
+            self._init_driver()
+        return self.driver
+    
+    def _init_driver(self):
+        # selenium和webdriver_manager只在真正使用浏览器时导入，
+        # ChromeDriverManager().install()需要联网下载驱动
+        from selenium import webdriver
+        from selenium.webdriver.chrome.service import Service
+        from selenium.webdriver.chrome.options import Options
+        from selenium.webdriver.support.ui import WebDriverWait
+        from webdriver_manager.chrome import ChromeDriverManager
+        
         # 配置Chrome选项
         chrome_options = Options()
         chrome_options.add_argument('--headless')
@@ -52,101 +231,207 @@ class JDCommentCrawler:
         # 设置等待时间
         self.wait = WebDriverWait(self.driver, 10)
     
-    def get_comments(self, product_id, page=0, score=0):
+    def get_comments(self, product_id, page=0, score=0, sort_type=SORT_RECOMMENDED):
+        # 浏览器启动失败时直接抛出，而不是当作空页面
+        driver = self._get_driver()
         try:
-            comment_url = f'https://club.jd.com/comment/productPageComments.action?callback=fetchJSON_comment98&productId={product_id}&score={score}&sortType=5&page={page}&pageSize=100&isShadowSku=0&fold=1&rid=0&sku={product_id}'
+            comment_url = requests.Request(
+                'GET', COMMENT_URL, params=build_comment_params(product_id, page, score, sort_type)
+            ).prepare().url
             
             time.sleep(random.uniform(2, 4))
-            self.driver.get(comment_url)
-            response_text = self.driver.page_source
-            
-            if 'fetchJSON_comment98' in response_text:
-                json_text = response_text.split('fetchJSON_comment98(')[1].split(');')[0]
-                result = json.loads(json_text)
-                
-                if 'comments' not in result or not result['comments']:
-                    return []
-                
-                return result['comments']
-                
-            return []
+            start = time.perf_counter()
+            driver.get(comment_url)
+            comments = parse_comment_page(driver.page_source)
+            record_request(time.perf_counter() - start, 0, comments is not None, engine='browser',
+                           page=page, score=score)
+            return comments or []
             
         except Exception as e:
             print(f"获取评论出错: {str(e)}")
             return []
     
-    def save_comments(self, product_id, good_count=500, bad_count=500):
-        if not os.path.exists('comments'):
-            os.makedirs('comments')
-        
-        good_comments = []
-        bad_comments = []
+    def _fetch_window(self, product_id, page, score, fetcher=None, sort_type=SORT_RECOMMENDED):
+        """
+        抓取从page开始的一批页面
+        :param fetcher: HTTPCommentFetcher实例，为None时使用浏览器抓取单页
+        :return: (每页的评论列表, 本批页数)
+        """
+        if fetcher:
+            pages = range(page, page + fetcher.max_workers)
+            return fetcher.fetch_pages(product_id, pages, score, sort_type), len(pages)
+        results = [self.get_comments(product_id, page, score=score, sort_type=sort_type)]
+        time.sleep(random.uniform(3, 5))
+        return results, 1
+    
+    def _crawl_stream(self, product_id, score, count, comment_type, fetcher=None, progress=None):
+        """
+        按页抓取某一评分档的评论，直到数量足够或连续3页为空
+        :param progress: 可选的回调progress(评论类型, 已抓取页数, 已获得评论数)
+        """
+        records = []
+        page = 0
+        empty_page_count = 0
         
-        try:
-            # 爬取好评
-            page = 0
-            empty_page_count = 0
+        while len(records) < count and empty_page_count < 3:
+            results, window = self._fetch_window(product_id, page, score, fetcher)
             
-            while len(good_comments) < good_count and empty_page_count < 3:
-                comments = self.get_comments(product_id, page, score=3)
-                
+            for comments in results:
                 if not comments:
                     empty_page_count += 1
                     if empty_page_count >= 3:
                         break
                 else:
                     empty_page_count = 0
-                    good_comments.extend([{
-                        'content': comment['content'],
-                        'score': comment['score'],
-                        'time': comment['creationTime'],
-                        'type': 'good'
-                    } for comment in comments])
-                
-                page += 1
-                time.sleep(random.uniform(3, 5))
+                    records.extend([to_record(comment, comment_type) for comment in comments])
             
-            # 爬取差评
-            page = 0
-            empty_page_count = 0
-            
-            while len(bad_comments) < bad_count and empty_page_count < 3:
-                comments = self.get_comments(product_id, page, score=1)
-                
+            page += window
+            if progress:
+                progress(comment_type, page, min(len(records), count))
+        
+        return records[:count]
+    
+    def _crawl_incremental(self, product_id, score, count, comment_type, state, fetcher=None, progress=None):
+        """
+        增量抓取某一评分档的评论
+        
+        先按时间倒序从第0页抓取新评论，遇到已抓取过的评论即停止；
+        若上次抓取未到达列表末尾，再从上次的页码继续回补历史评论。
+        count只是本次抓取的目标数量，已抓取页上的新评论会全部返回。
+        非首次抓取时第一阶段不受count限制：新评论若只抓一部分，下次从第0页开始
+        会立即遇到本次保存的评论而停止，与上次已抓取评论之间的部分就再也抓不到了。
+        :return: (新评论记录, 回补到的页码, 是否已到达列表末尾)
+        """
+        records = []
+        last_page, complete = state.get_progress(product_id, score)
+        seen_now = set()
+        pages_fetched = 0
+        
+        def collect(comments):
+            ids = [str(comment.get('id')) for comment in comments]
+            known = state.known_ids(product_id, score, ids) | seen_now
+            fresh = [c for c, i in zip(comments, ids) if i not in known]
+            seen_now.update(ids)
+            records.extend([to_record(comment, comment_type) for comment in fresh])
+            return len(fresh) < len(comments)
+        
+        # 第一阶段：抓取自上次以来的新评论，非首次抓取时一直抓到已抓取过的评论或列表末尾
+        page = 0
+        hit_known = False
+        empty_page_count = 0
+        while not hit_known and (len(records) < count or last_page >= 0) and empty_page_count < 3:
+            results, window = self._fetch_window(product_id, page, score, fetcher, SORT_BY_TIME)
+            for comments in results:
+                if not comments:
+                    empty_page_count += 1
+                    if empty_page_count >= 3:
+                        break
+                    continue
+                empty_page_count = 0
+                if collect(comments):
+                    hit_known = True
+                    break
+            page += window
+            pages_fetched += window
+            if progress:
+                progress(comment_type, pages_fetched, len(records))
+        
+        if last_page < 0:
+            # 首次抓取：第一阶段即是从头开始的完整抓取。
+            # 已抓取页上的评论全部保留，不按count截断，以免回补时漏掉
+            return records, page - 1, empty_page_count >= 3
+        
+        # 第二阶段：从上次中断的页码继续回补
+        page = last_page + 1
+        empty_page_count = 0
+        while not complete and len(records) < count:
+            results, window = self._fetch_window(product_id, page, score, fetcher, SORT_BY_TIME)
+            for comments in results:
                 if not comments:
                     empty_page_count += 1
                     if empty_page_count >= 3:
+                        complete = True
                         break
+                    continue
+                empty_page_count = 0
+                collect(comments)
+            last_page = page + window - 1
+            page += window
+            pages_fetched += window
+            if progress:
+                progress(comment_type, pages_fetched, len(records))
+        
+        return records, last_page, complete
+    
+    def save_comments(self, product_id, good_count=500, bad_count=500, engine=None,
+                      incremental=False, state=None, progress=None):
+        """
+        爬取好评和差评并保存为CSV
+        :param engine: 覆盖构造时指定的抓取引擎（'browser'或'http'）
+        :param incremental: 是否增量抓取。增量模式只抓取未见过的评论，
+                            并追加到每个商品唯一的 comments_<商品ID>.csv 中
+        :param state: 增量模式使用的CrawlStateStore，默认使用comments/crawl_state.db
+        :param progress: 可选的回调progress(评论类型, 已抓取页数, 已获得评论数)，每抓完一批页调用一次
+        :return: 保存的CSV文件名，没有评论时返回None
+        """
+        engine = engine or self.engine
+        if not os.path.exists('comments'):
+            os.makedirs('comments')
+        
+        if incremental:
+            state = state or CrawlStateStore()
+            crawl = lambda score, count, comment_type, fetcher=None: self._crawl_incremental(
+                product_id, score, count, comment_type, state, fetcher, progress)
+        else:
+            crawl = lambda score, count, comment_type, fetcher=None: (
+                self._crawl_stream(product_id, score, count, comment_type, fetcher, progress), None, None)
+        
+        with stage('crawl', product_id=product_id, engine=engine, incremental=incremental) as record:
+            fetcher = None
+            try:
+                if engine == 'http':
+                    fetcher = HTTPCommentFetcher(**self.http_options)
+                    # 好评和差评两个评分档同时抓取，共享连接池和限速器
+                    with ThreadPoolExecutor(max_workers=2) as streams:
+                        good_future = streams.submit(crawl, 3, good_count, 'good', fetcher)
+                        bad_future = streams.submit(crawl, 1, bad_count, 'bad', fetcher)
+                        good = good_future.result()
+                        bad = bad_future.result()
                 else:
-                    empty_page_count = 0
-                    bad_comments.extend([{
-                        'content': comment['content'],
-                        'score': comment['score'],
-                        'time': comment['creationTime'],
-                        'type': 'bad'
-                    } for comment in comments])
+                    good = crawl(3, good_count, 'good')
+                    bad = crawl(1, bad_count, 'bad')
                 
-                page += 1
-                time.sleep(random.uniform(3, 5))
-            
-            # 限制评论数量
-            good_comments = good_comments[:good_count]
-            bad_comments = bad_comments[:bad_count]
-            
-            # 合并所有评论
-            all_comments = good_comments + bad_comments
-            
-            if not all_comments:
-                return None
-            
-            # 保存数据
-            df = pd.DataFrame(all_comments)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            csv_filename = f'comments_{product_id}_{timestamp}.csv'
-            csv_path = os.path.join('comments', csv_filename)
-            df.to_csv(csv_path, index=False, encoding='utf-8-sig')
-            
-            return csv_filename
-            
-        finally:
-            self.driver.quit() 
\ No newline at end of file
+                # 合并所有评论
+                all_comments = good[0] + bad[0]
+                record['items'] = len(all_comments)
+                
+                if incremental:
+                    csv_filename = f'comments_{product_id}.csv'
+                    csv_path = os.path.join('comments', csv_filename)
+                    if all_comments:
+                        df = pd.DataFrame(all_comments)
+                        write_header = not os.path.exists(csv_path)
+                        df.to_csv(csv_path, mode='a', header=write_header, index=False,
+                                  encoding='utf-8-sig' if write_header else 'utf-8')
+                    # 数据落盘后再记录状态，避免中途失败导致评论被标记为已抓取却未保存
+                    for score, (records, last_page, complete) in ((3, good), (1, bad)):
+                        state.mark_seen(product_id, score, [r['id'] for r in records])
+                        state.set_progress(product_id, score, last_page, complete)
+                    return csv_filename if os.path.exists(csv_path) else None
+                
+                if not all_comments:
+                    return None
+                
+                # 保存数据
+                df = pd.DataFrame(all_comments)
+                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                csv_filename = f'comments_{product_id}_{timestamp}.csv'
+                csv_path = os.path.join('comments', csv_filename)
+                df.to_csv(csv_path, index=False, encoding='utf-8-sig')
+                
+                return csv_filename
+                
+            finally:
+                # 浏览器保留给下一次调用复用，由close()关闭
+                if fetcher:
+                    fetcher.close()
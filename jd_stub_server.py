@@ -0,0 +1,135 @@
+"""
+本地评论接口替身服务
+
+按京东评论接口的格式返回 fetchJSON_comment98(...) 页面，
+用于在不访问网络的情况下测试和压测HTTP抓取引擎。
+"""
+import json
+import random
+import threading
+import pandas as pd
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+def load_seed_comments(file_path):
+    """从已保存的评论CSV读取内容和评分，作为替身服务的数据来源"""
+    df = pd.read_csv(file_path, encoding='utf-8-sig')
+    return df[['content', 'score']].to_dict('records')
+
+
+def build_canned_comments(seeds, count, score_bucket, start_id=1):
+    """
+    根据种子评论生成指定评分档的接口评论数据
+    :param score_bucket: 3为好评档，1为差评档
+    """
+    pool = [s for s in seeds if (s['score'] >= 4) == (score_bucket == 3)] or seeds
+    base_time = datetime(2025, 1, 1)
+    comments = []
+    for i in range(count):
+        seed = pool[i % len(pool)]
+        comments.append({
+            'id': start_id + i,
+            'content': seed['content'],
+            'score': int(seed['score']),
+            'creationTime': (base_time - timedelta(minutes=37 * i)).strftime('%Y-%m-%d %H:%M:%S')
+        })
+    return comments
+
+
+class StubCommentServer:
+    """在后台线程中运行的评论接口替身服务"""
+
+    def __init__(self, comments_by_score, page_size=100, latency=0.0, fail_rate=0.0, port=0):
+        """
+        :param comments_by_score: {评分档: 评论列表}，评论格式与接口返回一致
+        :param latency: 每个请求的模拟延迟秒数
+        :param fail_rate: 随机返回503的概率，用于测试重试
+        :param port: 监听端口，0表示自动分配
+        """
+        self.comments_by_score = comments_by_score
+        self.page_size = page_size
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.request_count = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._make_handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/comment/productPageComments.action'
+
+    def render_page(self, score, page):
+        comments = self.comments_by_score.get(score, [])
+        start = page * self.page_size
+        payload = {'comments': comments[start:start + self.page_size]}
+        return f'fetchJSON_comment98({json.dumps(payload, ensure_ascii=False)});'
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stub.lock:
+                    stub.request_count += 1
+                if stub.latency:
+                    threading.Event().wait(stub.latency)
+                if stub.fail_rate and random.random() < stub.fail_rate:
+                    self.send_response(503)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                query = parse_qs(urlparse(self.path).query)
+                score = int(query.get('score', ['0'])[0])
+                page = int(query.get('page', ['0'])[0])
+                body = stub.render_page(score, page).encode('utf-8')
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='启动本地评论接口替身服务')
+    parser.add_argument('seed_csv', help='作为数据来源的评论CSV')
+    parser.add_argument('--count', type=int, default=1000, help='每个评分档的评论数量')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    seeds = load_seed_comments(args.seed_csv)
+    stub = StubCommentServer({
+        3: build_canned_comments(seeds, args.count, 3),
+        1: build_canned_comments(seeds, args.count, 1, start_id=args.count + 1),
+    }, latency=args.latency, fail_rate=args.fail_rate, port=args.port)
+    print(f'替身服务已启动: {stub.url}')
+    stub.server.serve_forever()
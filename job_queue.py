@@ -0,0 +1,266 @@
+"""
+本地后台任务队列
+
+爬取、分析和主题数扫描任务在进程池中执行，任务状态、进度和结果保存在SQLite中，
+Web应用提交任务后立即返回，之后随时读取进度和结果；多个会话可同时提交任务。
+"""
+import os
+import json
+import uuid
+import sqlite3
+import traceback
+import multiprocessing
+import numpy as np
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from jd_crawler import JDCommentCrawler
+from preprocess import CommentPreprocessor
+from corpus_store import CompactCorpus
+from analysis import CommentAnalyzer
+from clustering import CommentClusterer
+from seg_cache import SegmentationCache
+from topic_sweep import TopicSweep
+from instrumentation import metrics, profile_run
+
+JOB_DIR = 'jobs'
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+class JobStore:
+    """任务状态存储，可在多个进程中同时打开"""
+
+    def __init__(self, db_path=os.path.join(JOB_DIR, 'jobs.db')):
+        directory = os.path.dirname(db_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    progress TEXT NOT NULL DEFAULT '{}',
+                    result TEXT,
+                    error TEXT,
+                    created_at TEXT NOT NULL,
+                    started_at TEXT,
+                    finished_at TEXT
+                )
+            """)
+
+    def create(self, kind, params):
+        job_id = uuid.uuid4().hex[:12]
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO jobs (id, kind, params, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+                (job_id, kind, json.dumps(params, ensure_ascii=False), _now())
+            )
+        return job_id
+
+    def update(self, job_id, **fields):
+        for key in ('progress', 'result'):
+            if key in fields:
+                fields[key] = json.dumps(fields[key], ensure_ascii=False)
+        assignments = ', '.join(f'{key} = ?' for key in fields)
+        with self.conn:
+            self.conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", list(fields.values()) + [job_id])
+
+    @staticmethod
+    def _to_dict(row):
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        job['progress'] = json.loads(job['progress'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def get(self, job_id):
+        row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list(self, limit=20, status=None):
+        if status:
+            rows = self.conn.execute(
+                "SELECT * FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?", (status, limit)
+            ).fetchall()
+        else:
+            rows = self.conn.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+
+class JobContext:
+    """传给任务函数的上下文，用于上报进度和获取输出目录"""
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.job_id = job_id
+        self.state = {}
+
+    def progress(self, **values):
+        self.state.update(values)
+        self.store.update(self.job_id, progress=self.state)
+
+    @property
+    def output_dir(self):
+        path = os.path.join(JOB_DIR, self.job_id)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        return path
+
+
+def run_crawl_job(job, params):
+    def progress(comment_type, pages, comments):
+        job.progress(stage='crawl', **{f'{comment_type}_pages': pages, f'{comment_type}_comments': comments})
+
+    with JDCommentCrawler(engine=params.get('engine', 'http'), **params.get('http_options', {})) as crawler:
+        csv_file = crawler.save_comments(
+            params['product_id'],
+            good_count=params.get('good_count', 500),
+            bad_count=params.get('bad_count', 500),
+            incremental=params.get('incremental', False),
+            progress=progress
+        )
+    if not csv_file:
+        raise RuntimeError("没有爬取到评论")
+    return {'file': csv_file}
+
+
+def _load_texts(job, params):
+    job.progress(stage='preprocess', segmented=0)
+    corpus = CompactCorpus.for_file(
+        params['file'],
+        lambda: CommentPreprocessor(workers=params.get('preprocess_workers', 1), cache=SegmentationCache()),
+        progress=lambda count: job.progress(segmented=count)
+    )
+    texts = corpus.view(params['sentiment'])
+    if not len(texts):
+        raise ValueError(f"没有{params['sentiment']}评论数据")
+    return corpus, texts
+
+
+def run_sweep_job(job, params):
+    corpus, texts = _load_texts(job, params)
+    job.progress(stage='sweep')
+    sweep = TopicSweep(workers=params.get('workers'))
+    fingerprint, scores = sweep.run(texts, params.get('k_values', range(2, 11)),
+                                    progress=lambda done, total: job.progress(swept=done, sweep_total=total))
+    job.progress(stage='done')
+    return {
+        'corpus': corpus.path,
+        'sentiment': params['sentiment'],
+        'fingerprint': fingerprint,
+        'scores': scores,
+        'best_k': sweep.best_k(scores),
+    }
+
+
+def run_analysis_job(job, params):
+    """参数sweep为主题数扫描的语料指纹时，直接使用扫描中已训练好的模型，只做聚类"""
+    corpus, texts = _load_texts(job, params)
+    num_topics = params.get('num_topics', 5)
+    cached = TopicSweep().load(params['sweep'], num_topics) if params.get('sweep') else None
+    if cached:
+        lda_model = cached[0]
+    else:
+        job.progress(stage='lda', lda_pass=0)
+        analyzer = CommentAnalyzer.from_corpus(corpus)
+        lda_model, _ = analyzer.run_lda(
+            texts, num_topics=num_topics, workers=params.get('workers', 1), random_state=42, with_vis=False,
+            progress=lambda done, total: job.progress(lda_pass=done, lda_passes=total),
+            passes=params.get('passes', 20), early_stopping=params.get('early_stopping')
+        )
+
+    job.progress(stage='cluster')
+    clusterer = CommentClusterer(n_clusters=num_topics)
+    clusters = clusterer.fit(texts)
+
+    output_dir = job.output_dir
+    model_path = os.path.join(output_dir, 'lda.model')
+    lda_model.save(model_path)
+    np.save(os.path.join(output_dir, 'clusters.npy'), clusters)
+    np.save(os.path.join(output_dir, 'coords.npy'), clusterer.coords_)
+    job.progress(stage='done')
+    return {
+        'corpus': corpus.path,
+        'sentiment': params['sentiment'],
+        'num_topics': num_topics,
+        'topics': lda_model.print_topics(),
+        'passes': lda_model.passes,
+        'training': getattr(lda_model, 'training', None),
+        'cluster_keywords': clusterer.keywords_,
+        'model': model_path,
+        'clusters': os.path.join(output_dir, 'clusters.npy'),
+        'coords': os.path.join(output_dir, 'coords.npy'),
+    }
+
+
+JOB_HANDLERS = {
+    'crawl': run_crawl_job,
+    'analysis': run_analysis_job,
+    'sweep': run_sweep_job,
+}
+
+
+def _execute(db_path, job_id):
+    """
+    在工作进程中执行一个任务
+    结果中附带本任务各阶段的耗时指标；参数profile为True时把cProfile数据保存到任务输出目录
+    """
+    store = JobStore(db_path)
+    job = store.get(job_id)
+    store.update(job_id, status='running', started_at=_now())
+    context = JobContext(store, job_id)
+    mark = metrics.mark()
+    try:
+        profile_path = os.path.join(context.output_dir, 'profile.prof') if job['params'].get('profile') else None
+        with profile_run(profile_path):
+            result = JOB_HANDLERS[job['kind']](context, job['params'])
+        result['metrics'] = metrics.summary(since=mark)
+        result['requests'] = metrics.request_stats(since=mark)
+        if profile_path:
+            result['profile'] = profile_path
+        store.update(job_id, status='done', result=result, finished_at=_now())
+    except Exception as e:
+        store.update(job_id, status='failed', error=f"{e}\n{traceback.format_exc()}", finished_at=_now())
+
+
+class JobRunner:
+    def __init__(self, db_path=os.path.join(JOB_DIR, 'jobs.db'), workers=2):
+        """
+        :param workers: 同时执行的任务数
+        """
+        self.db_path = db_path
+        self.store = JobStore(db_path)
+        # Streamlit服务是多线程的，fork出的子进程可能继承其他线程持有的锁而死锁，改用spawn
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        self._recover()
+
+    def _recover(self):
+        """上次进程退出时：运行中的任务标记为失败，排队中的任务重新提交"""
+        for job in self.store.list(limit=-1, status='running'):
+            self.store.update(job['id'], status='failed', error='任务执行时服务已退出', finished_at=_now())
+        for job in reversed(self.store.list(limit=-1, status='queued')):
+            self.executor.submit(_execute, self.db_path, job['id'])
+
+    def submit(self, kind, **params):
+        if kind not in JOB_HANDLERS:
+            raise ValueError(f"未知的任务类型: {kind}")
+        job_id = self.store.create(kind, params)
+        self.executor.submit(_execute, self.db_path, job_id)
+        return job_id
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def list(self, limit=20):
+        return self.store.list(limit)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,75 @@
+"""
+pyLDAvis可视化的准备与缓存
+
+pyLDAvis.gensim_models.prepare要对每个主题在整个词表上计算相关度并做主题间距离投影，
+往往比训练本身还慢。这里把它拆成按需调用的步骤，并按模型指纹缓存渲染好的HTML。
+pyLDAvis导入很慢，只在真正需要计算时才导入，命中缓存时不会加载。
+"""
+import os
+import hashlib
+import numpy as np
+
+
+def model_fingerprint(lda_model, **options):
+    """根据模型参数、词表和可视化选项计算指纹"""
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(lda_model.state.sstats).tobytes())
+    h.update(np.ascontiguousarray(lda_model.alpha).tobytes())
+    h.update(np.ascontiguousarray(lda_model.eta).tobytes())
+    for token_id in range(len(lda_model.id2word)):
+        h.update(lda_model.id2word[token_id].encode('utf-8'))
+        h.update(b'\n')
+    h.update(repr(sorted(options.items())).encode('utf-8'))
+    return h.hexdigest()
+
+
+def prepare_vis(lda_model, corpus, dictionary, mds='pcoa', max_terms=None, lambda_step=0.01):
+    """
+    计算pyLDAvis的可视化数据
+    :param mds: 主题间距离的投影方法：'pcoa'最快，'mmds'和'tsne'更慢
+    :param max_terms: 只保留词频最高的max_terms个词参与计算，词表很大时可显著加速
+    :param lambda_step: 相关度滑块的步长，增大可减少计算量
+    """
+    import pyLDAvis
+    import pyLDAvis.gensim_models
+
+    data = pyLDAvis.gensim_models._extract_data(lda_model, corpus, dictionary)
+    if max_terms and len(data['vocab']) > max_terms:
+        keep = np.sort(np.argsort(data['term_frequency'])[-max_terms:])
+        topic_term = data['topic_term_dists'][:, keep]
+        data['topic_term_dists'] = topic_term / topic_term.sum(axis=1, keepdims=True)
+        data['term_frequency'] = data['term_frequency'][keep]
+        data['vocab'] = [data['vocab'][i] for i in keep]
+    return pyLDAvis.prepare(mds=mds, lambda_step=lambda_step, **data)
+
+
+class LDAVisCache:
+    """按模型指纹缓存渲染好的pyLDAvis HTML"""
+
+    def __init__(self, cache_dir=os.path.join('cache', 'ldavis')):
+        self.cache_dir = cache_dir
+
+    def get_html(self, lda_model, texts, mds='pcoa', max_terms=None, lambda_step=0.01):
+        """
+        获取模型的可视化HTML，命中缓存时不读取语料也不重新计算
+        :param texts: 分词后的评论（列表、CommentStream或CorpusView），仅在未命中缓存时使用
+        """
+        fingerprint = model_fingerprint(lda_model, mds=mds, max_terms=max_terms, lambda_step=lambda_step)
+        html_path = os.path.join(self.cache_dir, f'{fingerprint}.html')
+        if os.path.exists(html_path):
+            with open(html_path, 'r', encoding='utf-8') as f:
+                return f.read()
+
+        dictionary = lda_model.id2word
+        corpus = [dictionary.doc2bow(text) for text in texts]
+        vis_data = prepare_vis(lda_model, corpus, dictionary, mds, max_terms, lambda_step)
+        import pyLDAvis
+        html = pyLDAvis.prepared_data_to_html(vis_data)
+
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        tmp_path = f'{html_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(html)
+        os.replace(tmp_path, html_path)
+        return html
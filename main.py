@@ -1,20 +1,12 @@
-from jd_crawler import JDCommentCrawler
-from preprocess import CommentPreprocessor
-from analysis import CommentAnalyzer
+import sys
+from batch import main as run_batch
+
 
 def main():
-    # 爬取评论
-    crawler = JDCommentCrawler()
-    product_id = '你的产品ID'  # 需要替换为实际的美的电热水器产品ID
-    crawler.save_comments(product_id)
-    
-    # 预处理评论
-    preprocessor = CommentPreprocessor()
-    processed_comments = preprocessor.process_comments()
-    
-    # 分析评论
-    analyzer = CommentAnalyzer(processed_comments)
-    analyzer.analyze()
+    # 商品ID从命令行传入，可一次处理多个商品，例如：
+    #   python main.py 100012345678 100087654321
+    # 参数说明见 python batch.py --help
+    return run_batch(sys.argv[1:])
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    sys.exit(main())
@@ -1,13 +1,101 @@
 import json
 import jieba
 import re
+import numpy as np
 import pandas as pd
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 import os
+import sys
+import hashlib
+from seg_cache import segmentation_fingerprint
+from instrumentation import stage
+from dedup import NearDuplicateIndex
+
+# 进程池工作进程中的停用词表，由_init_worker在每个进程启动时加载一次
+_worker_stopwords = None
+
+
+def _init_worker(stopwords):
+    global _worker_stopwords
+    _worker_stopwords = stopwords
+    # 预先加载jieba词典，避免第一个分片承担加载开销
+    jieba.initialize()
+
+
+def _segment_chunk(texts):
+    """在工作进程中对一批已清洗的文本分词"""
+    return [[w for w in jieba.cut(text) if w not in _worker_stopwords and len(w) > 1]
+            for text in texts]
+
+
+def iter_json_array(path, block_size=1 << 20):
+    """逐个解析JSON数组文件中的元素，每次只读入block_size个字符"""
+    decoder = json.JSONDecoder()
+    whitespace = re.compile(r'[\s,]*')
+    with open(path, 'r', encoding='utf-8') as f:
+        buf = f.read(block_size).lstrip()
+        if not buf.startswith('['):
+            raise ValueError(f"{path} 不是JSON数组")
+        pos = 1
+        eof = False
+        while True:
+            pos = whitespace.match(buf, pos).end()
+            if pos < len(buf) and buf[pos] == ']':
+                return
+            try:
+                if pos >= len(buf):
+                    raise json.JSONDecodeError('需要更多数据', buf, pos)
+                obj, pos = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # 当前缓冲区里的元素不完整，丢弃已解析部分后补读下一块
+                block = f.read(block_size)
+                eof = not block
+                buf = buf[pos:] + block
+                pos = 0
+                continue
+            yield obj
+
+
+def load_content(source, rows):
+    """
+    按行号取回评论原文
+    :param source: CSV文件路径，或JSON数组文件路径（为空时为comments/comments.json）
+    :param rows: 评论在源文件中的行号
+    """
+    if source and source.endswith('.csv'):
+        content = pd.read_csv(source, encoding='utf-8-sig', usecols=['content'])['content']
+        return content.iloc[rows].tolist()
+    wanted = {row: i for i, row in enumerate(rows)}
+    result = [None] * len(rows)
+    json_path = source or os.path.join('comments', 'comments.json')
+    for row, comment in enumerate(iter_json_array(json_path)):
+        if row in wanted:
+            result[wanted[row]] = comment['content']
+    return result
+
 
 class CommentPreprocessor:
-    def __init__(self):
+    def __init__(self, workers=1, chunk_size=1000, cache=None, dedup=False, dedup_threshold=0.8):
+        """
+        :param workers: 分词使用的进程数，1为单进程，None为使用全部CPU核心
+        :param chunk_size: 多进程模式下每个分片的评论数
+        :param cache: 可选的SegmentationCache，命中的文本不再重复分词
+        :param dedup: 是否合并重复和近似重复的评论，每组只保留第一条参与建模
+        :param dedup_threshold: 判定为近似重复的相似度阈值
+        """
         self.stopwords = self.load_stopwords()
+        self.workers = workers or os.cpu_count()
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.dedup = dedup
+        self.dedup_threshold = dedup_threshold
+        # 最近一次stream_comments使用的去重索引，保存各组的评论数
+        self.dedup_index = None
+        self._fingerprint = None
+        self._pool = None
     
     def load_stopwords(self):
         with open('stopwords.txt', 'r', encoding='utf-8') as f:
@@ -22,48 +110,285 @@ class CommentPreprocessor:
         words = jieba.cut(text)
         return [w for w in words if w not in self.stopwords and len(w) > 1]
     
-    def process_comments(self, file_path=None):
+    def segmentation_fingerprint(self):
+        """分词配置（停用词表、jieba词典）的指纹，见seg_cache.segmentation_fingerprint"""
+        if self._fingerprint is None:
+            self._fingerprint = segmentation_fingerprint(self.stopwords)
+        return self._fingerprint
+    
+    def fingerprint(self):
+        """
+        预处理配置的指纹：分词配置加上去重设置
+        保存在紧凑语料的meta.json中，配置变化后已有的语料不再被视为最新
+        """
+        options = f'dedup={self.dedup_threshold}' if self.dedup else 'dedup=off'
+        return hashlib.sha1(f'{self.segmentation_fingerprint()}\0{options}'.encode('utf-8')).hexdigest()
+    
+    def segment_many(self, texts):
+        """
+        对一批已清洗的文本分词，结果顺序与输入一致
+        启用缓存时只对未命中的文本分词；多进程模式下按chunk_size分片并行处理
+        """
+        if self.cache is None:
+            return self._segment_uncached(texts)
+        
+        results = self.cache.get_many(self.segmentation_fingerprint(), texts)
+        missing = [i for i, words in enumerate(results) if words is None]
+        if missing:
+            # 同一批中重复的文本只分词一次
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            segmented = dict(zip(unique_texts, self._segment_uncached(unique_texts)))
+            self.cache.put_many(self.segmentation_fingerprint(), unique_texts, [segmented[t] for t in unique_texts])
+            for i in missing:
+                results[i] = segmented[texts[i]]
+        return results
+    
+    def _segment_uncached(self, texts):
+        if self.workers <= 1 or len(texts) <= self.chunk_size:
+            return [self.segment(text) for text in texts]
+        
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(self.stopwords,)
+            )
+        chunks = [texts[i:i + self.chunk_size] for i in range(0, len(texts), self.chunk_size)]
+        results = []
+        for words_list in self._pool.map(_segment_chunk, chunks):
+            results.extend(words_list)
+        return results
+    
+    def close(self):
+        """关闭分词进程池"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+    
+    def iter_comment_chunks(self, file_path=None, read_chunk_size=10000, start_row=0):
+        """
+        分块读取原始评论，每块为评论字典列表，每条评论附带其在源文件中的行号'row'
+        :param file_path: CSV文件路径，或JSON数组文件路径（为空时为comments/comments.json）
+        :param read_chunk_size: 每块的评论数
+        :param start_row: 跳过此行号之前的评论，用于只处理追加的新评论
+        """
         if file_path and file_path.endswith('.csv'):
-            # 从CSV文件读取
+            # 从CSV文件分块读取
             try:
-                df = pd.read_csv(file_path, encoding='utf-8-sig')
-                comments = df.to_dict('records')
+                reader = pd.read_csv(file_path, encoding='utf-8-sig', chunksize=read_chunk_size,
+                                     skiprows=range(1, start_row + 1) if start_row else None)
             except pd.errors.EmptyDataError:
                 print(f"CSV文件 {file_path} 为空")
-                return defaultdict(list), defaultdict(list)
+                return
+            with reader:
+                for df in reader:
+                    chunk = df.to_dict('records')
+                    for row, comment in zip(df.index, chunk):
+                        comment['row'] = int(row) + start_row
+                    yield chunk
         else:
-            # 从JSON文件读取
-            json_path = os.path.join('comments', 'comments.json')
-            try:
-                with open(json_path, 'r', encoding='utf-8') as f:
-                    comments = json.load(f)
-            except FileNotFoundError:
+            # 从JSON文件逐条解析，不一次性载入整个数组
+            json_path = file_path or os.path.join('comments', 'comments.json')
+            if not os.path.exists(json_path):
                 print(f"找不到文件: {json_path}")
-                return defaultdict(list), defaultdict(list)
+                return
+            chunk = []
+            for row, comment in enumerate(iter_json_array(json_path)):
+                if row < start_row:
+                    continue
+                comment['row'] = row
+                chunk.append(comment)
+                if len(chunk) >= read_chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+    
+    def stream_comments(self, file_path=None, read_chunk_size=10000, start_row=0, dedup_index=None):
+        """
+        流式预处理：逐块读取、清洗、分词并按评分分类
+        内存占用只与read_chunk_size有关，与文件大小无关
+        启用去重时，同一情感中与之前评论重复或近似重复的评论不再分词和输出，
+        输出记录附带所属组的编号'group'，组内评论数在读完后由self.dedup_index.counts给出
+        :param dedup_index: 继续使用的NearDuplicateIndex，用于增量处理追加的评论；
+                            为空且启用去重时新建一个
+        :return: 生成器，每条记录包含 row、sentiment、words、content、score、time
+        """
+        if dedup_index is None and self.dedup:
+            dedup_index = NearDuplicateIndex(threshold=self.dedup_threshold)
+        self.dedup_index = dedup_index
         
+        for chunk in self.iter_comment_chunks(file_path, read_chunk_size, start_row):
+            # 先清洗整块评论并按评分分类，再批量分词（多进程模式下并行）
+            kept = []
+            cleaned_texts = []
+            sentiments = []
+            with stage('clean_text', items=len(chunk)):
+                for comment in chunk:
+                    if comment['score'] >= 4:  # 4分以上为好评
+                        sentiment = 'positive'
+                    elif comment['score'] <= 2:  # 2分以下为差评
+                        sentiment = 'negative'
+                    else:
+                        continue
+                    cleaned_text = self.clean_text(comment['content'])
+                    if cleaned_text:
+                        kept.append(comment)
+                        cleaned_texts.append(cleaned_text)
+                        sentiments.append(sentiment)
+            
+            groups = None
+            if dedup_index is not None:
+                # 重复的评论在分词之前丢弃
+                with stage('dedup', items=len(cleaned_texts)) as record:
+                    start = len(dedup_index)
+                    groups = dedup_index.add_many(cleaned_texts, sentiments)
+                    unique = [i for i, group in enumerate(groups) if group == start + i]
+                    record['unique'] = len(unique)
+                kept = [kept[i] for i in unique]
+                cleaned_texts = [cleaned_texts[i] for i in unique]
+                sentiments = [sentiments[i] for i in unique]
+                groups = [int(groups[i]) for i in unique]
+            
+            with stage('segment', items=len(cleaned_texts), workers=self.workers,
+                       cached=self.cache is not None):
+                segmented = self.segment_many(cleaned_texts)
+            
+            for i, (comment, sentiment, words) in enumerate(zip(kept, sentiments, segmented)):
+                if not words:
+                    continue
+                record = {
+                    'row': comment['row'],
+                    'sentiment': sentiment,
+                    'words': words,
+                    'content': comment['content'],
+                    'score': comment['score'],
+                    'time': comment['time']
+                }
+                if groups is not None:
+                    record['group'] = groups[i]
+                yield record
+    
+    def process_comments(self, file_path=None, read_chunk_size=None):
+        """
+        一次性预处理全部评论
+        :return: (processed_comments, comment_details)，均以'positive'/'negative'为键；
+                 评论详情为CommentDetails，只保存行号、评分和时间，原文按需从源文件取回
+        """
         processed_comments = defaultdict(list)
-        comment_details = defaultdict(list)  # 存储详细信息
+        columns = defaultdict(lambda: {'rows': [], 'scores': [], 'times': [], 'groups': []})
         
-        for comment in comments:
-            cleaned_text = self.clean_text(comment['content'])
-            if not cleaned_text:
-                continue
-                
-            words = self.segment(cleaned_text)
-            if words:
-                if comment['score'] >= 4:  # 4分以上为好评
-                    processed_comments['positive'].append(words)
-                    comment_details['positive'].append({
-                        'content': comment['content'],
-                        'score': comment['score'],
-                        'time': comment['time']
-                    })
-                elif comment['score'] <= 2:  # 2分以下为差评
-                    processed_comments['negative'].append(words)
-                    comment_details['negative'].append({
-                        'content': comment['content'],
-                        'score': comment['score'],
-                        'time': comment['time']
-                    })
+        # 非流式模式一次读入全部评论，多进程分词时可以充分利用进程池
+        for record in self.stream_comments(file_path, read_chunk_size or sys.maxsize):
+            processed_comments[record['sentiment']].append(record['words'])
+            column = columns[record['sentiment']]
+            column['rows'].append(record['row'])
+            column['scores'].append(record['score'])
+            column['times'].append(record['time'])
+            column['groups'].append(record.get('group'))
         
-        return processed_comments, comment_details 
\ No newline at end of file
+        # 正面和负面评论连续存放在同一组数组中，两者都是其上的切片视图
+        order = [columns['positive'], columns['negative']]
+        groups = [group for column in order for group in column['groups']]
+        counts = None
+        if self.dedup_index is not None:
+            # 读完全部评论后各组的评论数才确定
+            counts = self.dedup_index.counts_of(groups)
+        details = CommentDetails(
+            rows=np.array([row for column in order for row in column['rows']], dtype=np.int64),
+            scores=np.array([score for column in order for score in column['scores']], dtype=np.int8),
+            times=pd.to_datetime(pd.Series([t for column in order for t in column['times']], dtype=object),
+                                 errors='coerce').to_numpy(dtype='datetime64[s]'),
+            source=file_path,
+            counts=counts
+        )
+        num_positive = len(columns['positive']['rows'])
+        comment_details = {'positive': details[:num_positive], 'negative': details[num_positive:]}
+        
+        return processed_comments, comment_details
+
+
+class CommentStream:
+    """
+    可重复迭代的预处理评论流
+
+    每次迭代都重新流式读取源文件，适合传给gensim等需要多次遍历语料、
+    但又不希望把全部语料放进内存的下游组件。
+    """
+    
+    def __init__(self, preprocessor, file_path=None, sentiment=None, field='words', read_chunk_size=10000):
+        """
+        :param sentiment: 只保留'positive'或'negative'，为None时保留全部
+        :param field: 每条记录输出的字段，'words'输出分词列表，
+                      'details'输出 content/score/time 字典，None输出完整记录
+        """
+        self.preprocessor = preprocessor
+        self.file_path = file_path
+        self.sentiment = sentiment
+        self.field = field
+        self.read_chunk_size = read_chunk_size
+    
+    def __iter__(self):
+        for record in self.preprocessor.stream_comments(self.file_path, self.read_chunk_size):
+            if self.sentiment and record['sentiment'] != self.sentiment:
+                continue
+            if self.field == 'words':
+                yield record['words']
+            elif self.field == 'details':
+                yield {'content': record['content'], 'score': record['score'], 'time': record['time']}
+            else:
+                yield record
+
+
+class CommentDetails:
+    """
+    列式存储的评论详情
+
+    每条评论只保存源文件中的行号、int8评分和datetime64时间，原文不随分词结果一起
+    常驻内存，需要时按行号从源文件（或已载入的源DataFrame）取回。
+    切片（details[a:b]）返回共享底层数组的视图，不复制数据。
+    """
+
+    def __init__(self, rows, scores, times, source=None, counts=None):
+        """
+        :param rows: 评论在源文件中的行号
+        :param source: 源文件路径，或含content列、按行号位置索引的DataFrame
+        :param counts: 可选，去重后每条评论代表的评论数
+        """
+        self.rows = rows
+        self.scores = scores
+        self.times = times
+        self.source = source
+        self.counts = counts
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        """切片返回视图；整数数组或布尔掩码返回副本"""
+        if isinstance(index, (int, np.integer)):
+            position = range(len(self))[index]
+            return self[position:position + 1].to_frame().iloc[0].to_dict()
+        return CommentDetails(self.rows[index], self.scores[index], self.times[index], self.source,
+                              self.counts[index] if self.counts is not None else None)
+
+    def __iter__(self):
+        """逐条产出 content/score/time 字典，兼容原来的字典列表"""
+        yield from self.to_frame().to_dict('records')
+
+    def content(self):
+        """按行号取回评论原文"""
+        if isinstance(self.source, pd.DataFrame):
+            return self.source['content'].iloc[self.rows].tolist()
+        return load_content(self.source, self.rows)
+
+    def to_frame(self):
+        """评论详情DataFrame（content、score、time，去重时另有count列）"""
+        frame = pd.DataFrame({
+            'content': self.content(),
+            'score': self.scores,
+            'time': pd.Series(self.times).dt.strftime('%Y-%m-%d %H:%M:%S'),
+        })
+        if self.counts is not None:
+            frame['count'] = self.counts
+        return frame
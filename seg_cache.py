@@ -0,0 +1,121 @@
+import os
+import time
+import sqlite3
+import threading
+import hashlib
+import jieba
+
+
+def segmentation_fingerprint(stopwords):
+    """
+    计算分词配置的指纹：停用词表 + jieba词典文件
+    任一变化都会得到不同的指纹，旧的缓存条目随之失效
+    """
+    h = hashlib.sha1()
+    for word in sorted(stopwords):
+        h.update(word.encode('utf-8'))
+        h.update(b'\n')
+    dict_path = jieba.dt.dictionary or os.path.join(os.path.dirname(jieba.__file__), jieba.DEFAULT_DICT_NAME)
+    h.update(os.path.abspath(dict_path).encode('utf-8'))
+    if os.path.isfile(dict_path):
+        stat = os.stat(dict_path)
+        h.update(f'{stat.st_size}:{stat.st_mtime_ns}'.encode('utf-8'))
+    # 通过add_word/load_userdict加入的自定义词
+    for word in sorted(jieba.dt.user_word_tag_tab):
+        h.update(f'{word}/{jieba.dt.user_word_tag_tab[word]}'.encode('utf-8'))
+    return h.hexdigest()
+
+
+class SegmentationCache:
+    """
+    按内容寻址的磁盘分词缓存
+
+    以 (分词配置指纹, 清洗后文本) 的哈希为键保存分词结果，
+    条目数超过max_entries时按最近使用时间淘汰（LRU）。
+    """
+
+    def __init__(self, path=os.path.join('cache', 'segmentation.db'), max_entries=500000):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.max_entries = max_entries
+        # Streamlit的各个会话共用同一个实例，共用一个连接并加锁；
+        # 批处理的多个分析进程同时打开同一个数据库时等待锁而不是立即失败
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS segments (
+                    key BLOB PRIMARY KEY,
+                    tokens TEXT NOT NULL,
+                    last_used REAL NOT NULL
+                ) WITHOUT ROWID
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_segments_last_used ON segments (last_used)")
+
+    @staticmethod
+    def make_key(fingerprint, text):
+        return hashlib.sha1(f'{fingerprint}\0{text}'.encode('utf-8')).digest()
+
+    def get_many(self, fingerprint, texts):
+        """
+        批量查询分词结果
+        :return: 与texts等长的列表，未命中的位置为None
+        """
+        keys = [self.make_key(fingerprint, text) for text in texts]
+        found = {}
+        with self.lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT key, tokens FROM segments WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                found.update(rows)
+            if found:
+                # 更新命中条目的使用时间，供LRU淘汰使用
+                now = time.time()
+                with self.conn:
+                    self.conn.executemany(
+                        "UPDATE segments SET last_used = ? WHERE key = ?",
+                        [(now, key) for key in found]
+                    )
+        results = []
+        for key in keys:
+            tokens = found.get(key)
+            if tokens is None:
+                results.append(None)
+            else:
+                results.append(tokens.split(' ') if tokens else [])
+        return results
+
+    def put_many(self, fingerprint, texts, tokens_list):
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO segments (key, tokens, last_used) VALUES (?, ?, ?)",
+                [(self.make_key(fingerprint, text), ' '.join(tokens), now)
+                 for text, tokens in zip(texts, tokens_list)]
+            )
+        self.evict()
+
+    def evict(self):
+        """条目数超过上限时删除最久未使用的条目"""
+        with self.lock:
+            count = self.conn.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+            excess = count - self.max_entries
+            if excess > 0:
+                with self.conn:
+                    self.conn.execute(
+                        "DELETE FROM segments WHERE key IN "
+                        "(SELECT key FROM segments ORDER BY last_used LIMIT ?)",
+                        (excess,)
+                    )
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,65 @@
+"""紧凑语料的缓存失效：源文件或分词配置变化后重新预处理"""
+import os
+import threading
+import pandas as pd
+from corpus_store import CompactCorpus
+from preprocess import CommentPreprocessor
+
+
+def write_comments(path, repeat=1):
+    pd.DataFrame({
+        'content': ['热水器加热很快，安装师傅专业', '客服态度差，安装收费太贵'] * repeat,
+        'score': [5, 1] * repeat,
+        'time': ['2025-01-01 10:00:00', '2025-01-02 10:00:00'] * repeat,
+    }).to_csv(path, index=False, encoding='utf-8-sig')
+
+
+def test_stopword_change_rebuilds_corpus(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'stopwords.txt').write_text('的\n', encoding='utf-8')
+    csv_path = str(tmp_path / 'comments.csv')
+    write_comments(csv_path)
+    builds = []
+
+    def load():
+        return CompactCorpus.for_file(csv_path, CommentPreprocessor, root=str(tmp_path / 'corpus'),
+                                      progress=builds.append)
+
+    assert '安装' in load().vocab
+    load()
+    assert len(builds) == 1
+
+    (tmp_path / 'stopwords.txt').write_text('的\n安装\n', encoding='utf-8')
+    corpus = load()
+    assert len(builds) == 2
+    assert '安装' not in corpus.vocab
+
+
+def test_concurrent_rebuild_is_serialized(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'stopwords.txt').write_text('的\n', encoding='utf-8')
+    csv_path = str(tmp_path / 'comments.csv')
+    root = str(tmp_path / 'corpus')
+    write_comments(csv_path)
+    old = CompactCorpus.for_file(csv_path, CommentPreprocessor, root=root)
+
+    # 源文件更新后两个任务同时打开语料：只重建一次，已打开的旧语料仍可读取
+    write_comments(csv_path, repeat=50)
+    os.utime(csv_path, (0, 0))
+    builds = []
+    corpora = []
+
+    def load():
+        corpora.append(CompactCorpus.for_file(csv_path, CommentPreprocessor, root=root,
+                                              progress=builds.append))
+
+    threads = [threading.Thread(target=load) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(builds) == 1
+    assert [len(corpus) for corpus in corpora] == [100, 100]
+    assert len(old) == 2
+    assert sum(len(words) for words in old.view()) == old.meta['num_tokens']
+    assert sorted(os.listdir(root)) == ['comments', 'comments.lock']
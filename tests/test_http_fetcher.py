@@ -0,0 +1,47 @@
+"""用本地替身服务测试HTTP抓取引擎的并发抓取和失败重试"""
+import random
+import pytest
+from jd_crawler import HTTPCommentFetcher
+from jd_stub_server import StubCommentServer, build_canned_comments
+from instrumentation import metrics
+
+SEEDS = [
+    {'content': '加热速度很快，外观漂亮，安装师傅很专业', 'score': 5},
+    {'content': '用了一周还不错，水温稳定', 'score': 4},
+    {'content': '安装收费太贵，客服也不回复', 'score': 1},
+    {'content': '漏水了，售后一直推脱', 'score': 2},
+]
+
+
+@pytest.fixture
+def flaky_server():
+    random.seed(0)
+    comments = {
+        3: build_canned_comments(SEEDS, 950, 3, start_id=1),
+        1: build_canned_comments(SEEDS, 420, 1, start_id=10000),
+    }
+    with StubCommentServer(comments, page_size=100, fail_rate=0.3) as server:
+        yield server
+
+
+def test_fetch_pages_with_retries(flaky_server):
+    fetcher = HTTPCommentFetcher(base_url=flaky_server.url, max_workers=4, rate=1000,
+                                 max_retries=8, backoff=0.01, timeout=5)
+    mark = metrics.mark()
+    try:
+        good = fetcher.fetch_pages('stub', range(10), 3)
+        bad = fetcher.fetch_pages('stub', range(5), 1)
+    finally:
+        fetcher.close()
+
+    # 每个评分档都完整取回，最后一页不满一页
+    assert sum(len(page) for page in good) == 950
+    assert sum(len(page) for page in bad) == 420
+    assert [len(page) for page in bad] == [100, 100, 100, 100, 20]
+    assert len({c['id'] for page in good + bad for c in page}) == 950 + 420
+
+    stats = metrics.request_stats(since=mark)
+    assert stats['requests'] == 15
+    assert stats['failures'] == 0
+    assert stats['retries'] > 0
+    assert flaky_server.request_count == 15 + stats['retries']
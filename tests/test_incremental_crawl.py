@@ -0,0 +1,31 @@
+"""增量抓取：新评论多于count时也要一直抓到上次已抓取的评论为止"""
+import os
+import pandas as pd
+from jd_crawler import JDCommentCrawler
+from crawl_state import CrawlStateStore
+from jd_stub_server import StubCommentServer, build_canned_comments
+
+SEEDS = [
+    {'content': '加热速度很快，外观漂亮', 'score': 5},
+    {'content': '漏水了，售后一直推脱', 'score': 1},
+]
+
+
+def test_new_comments_beyond_count_are_not_skipped(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    comments = {3: build_canned_comments(SEEDS, 300, 3, start_id=1), 1: []}
+    state = CrawlStateStore(str(tmp_path / 'crawl_state.db'))
+    with StubCommentServer(comments, page_size=100) as server, \
+            JDCommentCrawler(engine='http', base_url=server.url, max_workers=4, rate=1e6) as crawler:
+        csv_file = crawler.save_comments('stub', good_count=1000, bad_count=10, incremental=True, state=state)
+        assert state.get_progress('stub', 3)[1]
+
+        # 上次抓取之后新增500条，多于本次的count
+        comments[3] = build_canned_comments(SEEDS, 500, 3, start_id=10000) + comments[3]
+        crawler.save_comments('stub', good_count=250, bad_count=10, incremental=True, state=state)
+
+    saved = pd.read_csv(os.path.join('comments', csv_file), encoding='utf-8-sig')
+    assert len(saved) == 800
+    assert saved['id'].is_unique
+    assert state.seen_count('stub', 3) == 800
+    state.close()
@@ -0,0 +1,38 @@
+"""在线更新：新评论按占比并入模型，已有主题不被新批次覆盖"""
+import random
+import numpy as np
+from analysis import CommentAnalyzer
+
+VOCABULARIES = [
+    ['加热', '速度', '水温', '恒温', '出水'],
+    ['安装', '师傅', '收费', '上门', '打孔'],
+    ['客服', '售后', '退货', '回复', '态度'],
+]
+NEW_WORDS = ['噪音', '异味', '漏电', '生锈', '掉漆']
+
+
+def make_docs(vocabulary, count, rng):
+    return [[rng.choice(vocabulary) for _ in range(8)] for _ in range(count)]
+
+
+def test_update_keeps_existing_topics(tmp_path):
+    rng = random.Random(0)
+    texts = [doc for vocabulary in VOCABULARIES for doc in make_docs(vocabulary, 200, rng)]
+    analyzer = CommentAnalyzer({'positive': [], 'negative': []}, {}, product_id='test', model_dir=str(tmp_path))
+    lda_model, _ = analyzer.run_lda(texts, num_topics=3, random_state=0, with_vis=False, passes=10)
+    analyzer.save_model('negative', lda_model)
+    before = lda_model.get_topics()
+
+    updated = analyzer.update_lda('negative', make_docs(NEW_WORDS, 60, rng), num_topics=3)
+    after = updated.get_topics()
+    old_terms = before.shape[1]
+
+    # 新评论只占全部评论的1/11，每个主题落在新词上的概率都应远小于一半
+    new_mass = after[:, old_terms:].sum(axis=1)
+    assert new_mass.max() < 0.2
+
+    # 每个旧主题在更新后的模型中仍有高度相似的主题
+    a = before / np.linalg.norm(before, axis=1, keepdims=True)
+    b = after[:, :old_terms] / np.linalg.norm(after[:, :old_terms], axis=1, keepdims=True)
+    assert (a @ b.T).max(axis=1).min() > 0.9
+    assert updated.state.numdocs == 660
@@ -0,0 +1,35 @@
+"""主题趋势索引：没有已知词的评论不计入任何主题"""
+import random
+from analysis import CommentAnalyzer
+from inference import TopicInferencer
+from topic_trends import TopicTrendIndex
+
+VOCABULARIES = [
+    ['加热', '速度', '水温', '恒温'],
+    ['安装', '师傅', '收费', '上门'],
+]
+
+
+def test_comments_without_known_terms_are_not_assigned(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'stopwords.txt').write_text('的\n', encoding='utf-8')
+    rng = random.Random(0)
+    texts = [[rng.choice(vocabulary) for _ in range(6)] for vocabulary in VOCABULARIES for _ in range(50)]
+    analyzer = CommentAnalyzer({'positive': [], 'negative': []}, {})
+    lda_model, _ = analyzer.run_lda(texts, num_topics=2, random_state=0, with_vis=False, passes=5)
+
+    comments = [{'content': '安装师傅上门收费', 'time': '2025-01-01 10:00:00'},
+                {'content': '加热速度快，水温恒温', 'time': '2025-01-01 11:00:00'}]
+    comments += [{'content': content, 'time': '2025-01-01 12:00:00'}
+                 for content in ['👍👍👍', '!!!', '好评好评好评']]
+    index = TopicTrendIndex(str(tmp_path / 'trends.db'))
+    try:
+        inferencer = TopicInferencer(lda_model)
+        assert index.update('p', 'positive', inferencer, comments) == 5
+        assert index.update('p', 'positive', inferencer, comments) == 0
+        counts = index.topic_counts('p', 'positive', days=None)
+        weights = index.topic_counts('p', 'positive', days=None, measure='weight')
+        assert int(counts.values.sum()) == 2
+        assert abs(float(weights.values.sum()) - 2) < 1e-6
+    finally:
+        index.close()
@@ -0,0 +1,157 @@
+"""
+主题数扫描
+
+对同一份语料并行训练多个主题数k的LDA模型并计算主题一致性（coherence），
+模型按 (语料指纹, k) 缓存在磁盘上，切换主题数时直接加载，无需重新训练。
+gensim只在训练或加载模型时才导入。
+"""
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def corpus_fingerprint(dictionary, corpus):
+    """根据词典和词袋语料的内容计算指纹"""
+    h = hashlib.sha1()
+    for token_id in range(len(dictionary)):
+        h.update(dictionary[token_id].encode('utf-8'))
+        h.update(b'\n')
+    for bow in corpus:
+        h.update(repr([(int(i), int(c)) for i, c in bow]).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _train_one(sweep_dir, k, passes, random_state, coherence):
+    """在工作进程中训练一个主题数的模型，从磁盘读取语料以避免在进程间传递大对象"""
+    from gensim import corpora, models
+    from gensim.models import CoherenceModel
+
+    dictionary = corpora.Dictionary.load(os.path.join(sweep_dir, 'dictionary.dict'))
+    corpus = corpora.MmCorpus(os.path.join(sweep_dir, 'corpus.mm'))
+    lda_model = models.LdaModel(
+        corpus=corpus,
+        num_topics=k,
+        id2word=dictionary,
+        passes=passes,
+        random_state=random_state
+    )
+
+    if coherence == 'u_mass':
+        cm = CoherenceModel(model=lda_model, corpus=corpus, dictionary=dictionary, coherence=coherence)
+    else:
+        # c_v等基于滑动窗口的指标需要原始分词文本
+        with open(os.path.join(sweep_dir, 'texts.jsonl'), 'r', encoding='utf-8') as f:
+            texts = [json.loads(line) for line in f]
+        cm = CoherenceModel(model=lda_model, texts=texts, dictionary=dictionary,
+                            coherence=coherence, processes=1)
+    score = float(cm.get_coherence())
+
+    lda_model.save(os.path.join(sweep_dir, f'k{k}.model'))
+    with open(os.path.join(sweep_dir, f'k{k}_{coherence}.json'), 'w', encoding='utf-8') as f:
+        json.dump({'k': k, 'coherence': score, 'metric': coherence}, f)
+    return k, score
+
+
+class TopicSweep:
+    def __init__(self, cache_dir=os.path.join('cache', 'lda_sweep'), workers=None,
+                 passes=20, random_state=42, coherence='u_mass'):
+        """
+        :param workers: 并行训练的进程数，默认使用全部CPU核心
+        :param coherence: 一致性指标，'u_mass'只需词袋语料，'c_v'更准确但更慢
+        """
+        self.cache_dir = cache_dir
+        self.workers = workers or os.cpu_count()
+        self.passes = passes
+        self.random_state = random_state
+        self.coherence = coherence
+
+    def _sweep_dir(self, fingerprint):
+        # 训练参数不同的模型不能混用，一并计入目录名
+        return os.path.join(self.cache_dir, f'{fingerprint}_p{self.passes}_s{self.random_state}')
+
+    def prepare(self, texts):
+        """
+        构造并缓存语料，返回语料指纹
+        :param texts: 分词后的评论列表、CommentStream或CorpusView
+        """
+        from gensim import corpora
+
+        if hasattr(texts, 'lda_inputs'):
+            dictionary, corpus = texts.lda_inputs()
+        else:
+            dictionary = corpora.Dictionary(texts)
+            corpus = [dictionary.doc2bow(text) for text in texts]
+        fingerprint = corpus_fingerprint(dictionary, corpus)
+        sweep_dir = self._sweep_dir(fingerprint)
+        if not os.path.exists(os.path.join(sweep_dir, 'corpus.mm')):
+            os.makedirs(sweep_dir, exist_ok=True)
+            dictionary.save(os.path.join(sweep_dir, 'dictionary.dict'))
+            corpora.MmCorpus.serialize(os.path.join(sweep_dir, 'corpus.mm'), corpus)
+            with open(os.path.join(sweep_dir, 'texts.jsonl'), 'w', encoding='utf-8') as f:
+                for text in texts:
+                    f.write(json.dumps(list(text), ensure_ascii=False) + '\n')
+        return fingerprint
+
+    def scores(self, fingerprint):
+        """读取已缓存的各主题数的一致性得分：{k: coherence}"""
+        sweep_dir = self._sweep_dir(fingerprint)
+        results = {}
+        if not os.path.exists(sweep_dir):
+            return results
+        for name in os.listdir(sweep_dir):
+            if name.startswith('k') and name.endswith('.json'):
+                with open(os.path.join(sweep_dir, name), 'r', encoding='utf-8') as f:
+                    info = json.load(f)
+                if info['metric'] == self.coherence:
+                    results[info['k']] = info['coherence']
+        return dict(sorted(results.items()))
+
+    def run(self, texts, k_values=range(2, 11), progress=None):
+        """
+        并行训练所有尚未缓存的主题数
+        :param progress: 可选的回调progress(已完成的主题数个数, 总个数)，每训练完一个模型调用一次
+        :return: (语料指纹, {k: coherence})
+        """
+        k_values = list(k_values)
+        fingerprint = self.prepare(texts)
+        cached = self.scores(fingerprint)
+        missing = [k for k in k_values if k not in cached]
+        done = len(k_values) - len(missing)
+        if progress:
+            progress(done, len(k_values))
+        if missing:
+            sweep_dir = self._sweep_dir(fingerprint)
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(missing))) as executor:
+                futures = [
+                    executor.submit(_train_one, sweep_dir, k, self.passes, self.random_state, self.coherence)
+                    for k in missing
+                ]
+                for future in as_completed(futures):
+                    k, score = future.result()
+                    cached[k] = score
+                    done += 1
+                    if progress:
+                        progress(done, len(k_values))
+        return fingerprint, {k: cached[k] for k in k_values}
+
+    @staticmethod
+    def best_k(scores):
+        """一致性得分最高的主题数（u_mass和c_v都是越大越好）"""
+        return max(scores, key=scores.get) if scores else None
+
+    def load(self, fingerprint, k):
+        """
+        加载缓存的模型
+        :return: (lda_model, corpus, dictionary)，未缓存时返回None
+        """
+        sweep_dir = self._sweep_dir(fingerprint)
+        model_file = os.path.join(sweep_dir, f'k{k}.model')
+        if not os.path.exists(model_file):
+            return None
+        from gensim import corpora, models
+        dictionary = corpora.Dictionary.load(os.path.join(sweep_dir, 'dictionary.dict'))
+        corpus = corpora.MmCorpus(os.path.join(sweep_dir, 'corpus.mm'))
+        lda_model = models.LdaModel.load(model_file)
+        lda_model.id2word = dictionary
+        return lda_model, corpus, dictionary
@@ -0,0 +1,363 @@
+"""
+按时间切片的主题趋势索引
+
+用已训练的模型（inference.TopicInferencer）给每条评论推断主题，按 (商品, 情感, 模型, 日期, 主题)
+累加评论数和主题概率之和，保存在SQLite中。已计入的评论按 (时间, 内容) 的哈希记录，
+重复更新或不同快照中的相同评论不会被重复计数，新评论只更新其所在日期的计数。
+
+每个商品每种情感固定使用一个趋势模型：第一次更新时把已保存的模型复制到索引旁的
+trend_models/<商品ID>/<情感>/ 并登记，之后重新训练也不影响趋势，只推断新评论；
+显式重新登记（--reregister）时才换用新模型，旧模型的计数随之删除。
+"最近90天负面评论的主题占比"这类查询只读取几百行预聚合数据，无需重新训练或扫描原始CSV。
+
+    index = TopicTrendIndex()
+    index.update_from_file('100104067842', 'comments/comments_100104067842.csv')
+    index.topic_share('100104067842', 'negative', days=90, granularity='week')
+
+命令行：
+    python topic_trends.py update 100104067842 comments/comments_100104067842.csv
+    python topic_trends.py update 100104067842 comments/comments_100104067842.csv --reregister
+    python topic_trends.py share 100104067842 negative --days 90 --granularity week
+"""
+import os
+import json
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from inference import TopicInferencer
+from lda_vis import model_fingerprint
+from instrumentation import stage
+
+
+def comment_key(content, time):
+    """评论的去重键：评论没有稳定的ID，以时间和内容的哈希代替"""
+    return hashlib.blake2b(f'{time}\0{content}'.encode('utf-8'), digest_size=8).digest()
+
+
+def comment_sentiment(score):
+    """与CommentPreprocessor相同的评分划分，中评返回None"""
+    if score >= 4:
+        return 'positive'
+    if score <= 2:
+        return 'negative'
+    return None
+
+
+class TopicTrendIndex:
+    def __init__(self, db_path=os.path.join('models', 'topic_trends.db')):
+        directory = os.path.dirname(db_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.db_path = db_path
+        # 登记的趋势模型的副本，与重新训练时被覆盖的models/<商品ID>/<情感>/分开保存
+        self.model_root = os.path.join(directory, 'trend_models')
+        # 批处理的多个分析进程可能同时写入，等待锁而不是立即失败
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS trend_models (
+                    product_id TEXT NOT NULL,
+                    sentiment TEXT NOT NULL,
+                    model_id TEXT NOT NULL,
+                    num_topics INTEGER NOT NULL,
+                    labels TEXT NOT NULL,
+                    registered_at TEXT NOT NULL,
+                    PRIMARY KEY (product_id, sentiment, model_id)
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS topic_counts (
+                    product_id TEXT NOT NULL,
+                    sentiment TEXT NOT NULL,
+                    model_id TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    topic INTEGER NOT NULL,
+                    comments INTEGER NOT NULL,
+                    weight REAL NOT NULL,
+                    PRIMARY KEY (product_id, sentiment, model_id, day, topic)
+                ) WITHOUT ROWID
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS counted_comments (
+                    product_id TEXT NOT NULL,
+                    sentiment TEXT NOT NULL,
+                    model_id TEXT NOT NULL,
+                    comment_key BLOB NOT NULL,
+                    PRIMARY KEY (product_id, sentiment, model_id, comment_key)
+                ) WITHOUT ROWID
+            """)
+
+    def register_model(self, product_id, sentiment, lda_model, num_words=5):
+        """
+        登记该商品该情感的趋势模型，之前登记的其他模型及其计数被删除；同一模型重复登记时不变
+        :return: 模型ID（模型指纹的前16位）
+        """
+        model_id = model_fingerprint(lda_model)[:16]
+        labels = [[word for word, _ in lda_model.show_topic(topic, num_words)]
+                  for topic in range(lda_model.num_topics)]
+        key = (str(product_id), sentiment, model_id)
+        with self.lock, self.conn:
+            for table in ('trend_models', 'topic_counts', 'counted_comments'):
+                self.conn.execute(
+                    f"DELETE FROM {table} WHERE product_id = ? AND sentiment = ? AND model_id != ?", key)
+            self.conn.execute(
+                "INSERT OR IGNORE INTO trend_models "
+                "(product_id, sentiment, model_id, num_topics, labels, registered_at) VALUES (?, ?, ?, ?, ?, ?)",
+                key + (lda_model.num_topics, json.dumps(labels, ensure_ascii=False),
+                       datetime.now().isoformat(timespec='seconds'))
+            )
+        return model_id
+
+    def pinned_path(self, product_id, sentiment):
+        """登记的趋势模型副本所在目录"""
+        return os.path.join(self.model_root, str(product_id), sentiment)
+
+    def pin_saved_model(self, product_id, sentiment, model_dir='models'):
+        """
+        把已保存的模型（model_dir/<商品ID>/<情感>/）复制为趋势模型并登记
+        :return: 加载了该模型的TopicInferencer
+        """
+        source = os.path.join(model_dir, str(product_id), sentiment)
+        target = self.pinned_path(product_id, sentiment)
+        tmp_path = f'{target}.tmp'
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        shutil.copytree(source, tmp_path)
+        if os.path.exists(target):
+            shutil.rmtree(target)
+        os.replace(tmp_path, target)
+        inferencer = TopicInferencer.load(target)
+        self.register_model(product_id, sentiment, inferencer.lda_model)
+        return inferencer
+
+    def _known_keys(self, product_id, sentiment, model_id, keys):
+        known = set()
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ','.join('?' * len(batch))
+            rows = self.conn.execute(
+                f"SELECT comment_key FROM counted_comments "
+                f"WHERE product_id = ? AND sentiment = ? AND model_id = ? AND comment_key IN ({placeholders})",
+                [str(product_id), sentiment, model_id] + batch
+            ).fetchall()
+            known.update(row[0] for row in rows)
+        return known
+
+    def update(self, product_id, sentiment, inferencer, comments, batch_size=1000):
+        """
+        把尚未计入的评论按日期和主题累加到索引中，没有模型词典中的词的评论只记为已计入，不计入任何主题
+        :param inferencer: 该商品该情感的TopicInferencer，其模型须为登记的趋势模型；尚未登记模型时登记该模型
+        :param comments: 评论字典的可迭代对象，需包含content和time
+        :return: 新计入的评论数
+        """
+        model_id = model_fingerprint(inferencer.lda_model)[:16]
+        pinned = self.pinned_model(product_id, sentiment)
+        if pinned is None:
+            self.register_model(product_id, sentiment, inferencer.lda_model)
+        elif pinned != model_id:
+            raise ValueError(f"商品{product_id}的{sentiment}趋势模型为{pinned}，"
+                             f"使用模型{model_id}前需先用register_model重新登记")
+        added = 0
+        batch = []
+        for comment in comments:
+            batch.append(comment)
+            if len(batch) >= batch_size:
+                added += self._update_batch(product_id, sentiment, model_id, inferencer, batch)
+                batch = []
+        if batch:
+            added += self._update_batch(product_id, sentiment, model_id, inferencer, batch)
+        return added
+
+    def _update_batch(self, product_id, sentiment, model_id, inferencer, comments):
+        days = pd.to_datetime(pd.Series([c.get('time') for c in comments]), errors='coerce')
+        # 无法解析时间的评论无法归入任何日期，不计入
+        new = {}
+        for comment, day in zip(comments, days):
+            if pd.isna(day):
+                continue
+            new.setdefault(comment_key(comment['content'], comment['time']), (comment['content'], day))
+        with self.lock:
+            known = self._known_keys(product_id, sentiment, model_id, list(new))
+        for key in known:
+            del new[key]
+        if not new:
+            return 0
+
+        with stage('topic_trends', items=len(new), sentiment=sentiment):
+            texts = [content for content, _ in new.values()]
+            result = inferencer.infer(texts)
+            # 没有模型词典中的词的评论（纯表情、"此用户未填写评价内容"等）只得到先验分布，
+            # 不归入任何主题，只记为已计入
+            known = result['known_terms'] > 0
+            frame = pd.DataFrame({
+                'day': [day.strftime('%Y-%m-%d') for _, day in new.values()],
+                'topic': result['top_topic'],
+            })[known]
+            # 评论数按概率最大的主题计；weight为各主题概率之和，按全部主题分别累加
+            totals = frame.groupby(['day', 'topic']).size().rename('comments').to_frame()
+            weights = pd.DataFrame(result['topics'][known].astype(np.float64)).groupby(frame['day'].to_numpy()).sum()
+            weights = weights.stack().rename('weight')
+            weights.index.names = ['day', 'topic']
+            merged = weights.to_frame().join(totals, how='left').fillna({'comments': 0})
+            rows = [(str(product_id), sentiment, model_id, day, int(topic), int(row.comments), float(row.weight))
+                    for (day, topic), row in merged.iterrows()]
+            with self.lock, self.conn:
+                self.conn.executemany(
+                    "INSERT INTO topic_counts (product_id, sentiment, model_id, day, topic, comments, weight) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (product_id, sentiment, model_id, day, topic) DO UPDATE SET "
+                    "comments = comments + excluded.comments, weight = weight + excluded.weight",
+                    rows
+                )
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO counted_comments (product_id, sentiment, model_id, comment_key) "
+                    "VALUES (?, ?, ?, ?)",
+                    [(str(product_id), sentiment, model_id, key) for key in new]
+                )
+        return len(new)
+
+    def update_from_file(self, product_id, file_path, model_dir='models', sentiments=('positive', 'negative'),
+                         read_chunk_size=10000, reregister=False):
+        """
+        用登记的趋势模型更新该商品的趋势索引，只推断尚未计入的评论
+        尚未登记时先登记商品已保存的模型（model_dir/<商品ID>/<情感>/），都没有的情感被跳过
+        :param reregister: 是否改用model_dir中当前的模型重新登记，旧模型的计数被删除、全部评论重新计入
+        :return: {情感: 新计入的评论数}
+        """
+        inferencers = {}
+        for sentiment in sentiments:
+            saved = os.path.exists(os.path.join(model_dir, str(product_id), sentiment, 'lda.model'))
+            pinned = self.pinned_model(product_id, sentiment) is not None and \
+                os.path.exists(os.path.join(self.pinned_path(product_id, sentiment), 'lda.model'))
+            if saved and (reregister or not pinned):
+                inferencers[sentiment] = self.pin_saved_model(product_id, sentiment, model_dir)
+            elif pinned:
+                inferencers[sentiment] = TopicInferencer.load(self.pinned_path(product_id, sentiment))
+            else:
+                print(f"没有商品{product_id}的{sentiment}模型，跳过趋势更新")
+        added = {sentiment: 0 for sentiment in inferencers}
+        if not inferencers:
+            return added
+        preprocessor = next(iter(inferencers.values())).preprocessor
+        for chunk in preprocessor.iter_comment_chunks(file_path, read_chunk_size):
+            by_sentiment = {sentiment: [] for sentiment in inferencers}
+            for comment in chunk:
+                sentiment = comment_sentiment(comment['score'])
+                if sentiment in by_sentiment:
+                    by_sentiment[sentiment].append(comment)
+            for sentiment, comments in by_sentiment.items():
+                added[sentiment] += self.update(product_id, sentiment, inferencers[sentiment], comments)
+        return added
+
+    def pinned_model(self, product_id, sentiment):
+        """登记的趋势模型ID，没有时返回None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT model_id FROM trend_models WHERE product_id = ? AND sentiment = ? "
+                "ORDER BY registered_at DESC, rowid DESC LIMIT 1",
+                (str(product_id), sentiment)
+            ).fetchone()
+        return row[0] if row else None
+
+    def topic_labels(self, product_id, sentiment, model_id=None):
+        """各主题的关键词列表"""
+        model_id = model_id or self.pinned_model(product_id, sentiment)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT labels FROM trend_models WHERE product_id = ? AND sentiment = ? AND model_id = ?",
+                (str(product_id), sentiment, model_id)
+            ).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def topic_counts(self, product_id, sentiment, days=90, granularity='day', end=None, model_id=None,
+                     measure='comments'):
+        """
+        各时间段各主题的评论数
+        :param days: 查询的天数，None为全部
+        :param granularity: 'day'或'week'（以周一为一周的开始）
+        :param end: 截止日期，默认为索引中该商品最新的日期
+        :param model_id: 默认为登记的趋势模型
+        :param measure: 'comments'按概率最大的主题计数，'weight'按主题概率之和计数
+        :return: DataFrame，行为时间段起始日期，列为主题编号，没有数据时为空
+        """
+        if granularity not in ('day', 'week'):
+            raise ValueError(f"不支持的时间粒度: {granularity}")
+        if measure not in ('comments', 'weight'):
+            raise ValueError(f"不支持的计数方式: {measure}")
+        model_id = model_id or self.pinned_model(product_id, sentiment)
+        key = (str(product_id), sentiment, model_id)
+        with self.lock:
+            if end is None:
+                end = self.conn.execute(
+                    "SELECT MAX(day) FROM topic_counts WHERE product_id = ? AND sentiment = ? AND model_id = ?", key
+                ).fetchone()[0]
+            if end is None:
+                return pd.DataFrame()
+            end = pd.Timestamp(end).strftime('%Y-%m-%d')
+            start = (pd.Timestamp(end) - pd.Timedelta(days=days - 1)).strftime('%Y-%m-%d') if days else ''
+            rows = self.conn.execute(
+                f"SELECT day, topic, {measure} FROM topic_counts "
+                f"WHERE product_id = ? AND sentiment = ? AND model_id = ? AND day BETWEEN ? AND ?",
+                key + (start, end)
+            ).fetchall()
+        frame = pd.DataFrame(rows, columns=['day', 'topic', 'value'])
+        if granularity == 'week':
+            frame['day'] = (pd.to_datetime(frame['day']).dt.to_period('W-SUN').dt.start_time
+                            .dt.strftime('%Y-%m-%d'))
+        table = frame.pivot_table(index='day', columns='topic', values='value', aggfunc='sum', fill_value=0)
+        table.index.name = granularity
+        table.columns.name = 'topic'
+        return table
+
+    def topic_share(self, product_id, sentiment, days=90, granularity='day', end=None, model_id=None,
+                    measure='comments'):
+        """各时间段内各主题所占的比例，参数同topic_counts"""
+        counts = self.topic_counts(product_id, sentiment, days, granularity, end, model_id, measure)
+        return counts.div(counts.sum(axis=1), axis=0) if not counts.empty else counts
+
+    def close(self):
+        self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='主题趋势索引')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    update_parser = subparsers.add_parser('update', help='用已保存的模型把评论文件计入索引')
+    update_parser.add_argument('product_id')
+    update_parser.add_argument('file', help='评论CSV文件')
+    update_parser.add_argument('--model-dir', default='models')
+    update_parser.add_argument('--reregister', action='store_true',
+                               help='改用model-dir中当前的模型重新登记，旧模型的趋势计数被删除')
+    share_parser = subparsers.add_parser('share', help='查询各时间段的主题占比')
+    share_parser.add_argument('product_id')
+    share_parser.add_argument('sentiment', choices=['positive', 'negative'])
+    share_parser.add_argument('--days', type=int, default=90)
+    share_parser.add_argument('--granularity', choices=['day', 'week'], default='week')
+    share_parser.add_argument('--end', default=None, help='截止日期，默认为最新的评论日期')
+    for sub in (update_parser, share_parser):
+        sub.add_argument('--db', default=os.path.join('models', 'topic_trends.db'))
+    args = parser.parse_args()
+
+    index = TopicTrendIndex(args.db)
+    try:
+        if args.command == 'update':
+            added = index.update_from_file(args.product_id, args.file, args.model_dir, reregister=args.reregister)
+            print(json.dumps(added, ensure_ascii=False))
+        else:
+            share = index.topic_share(args.product_id, args.sentiment, args.days, args.granularity, args.end)
+            labels = index.topic_labels(args.product_id, args.sentiment)
+            for topic, words in enumerate(labels):
+                print(f"主题{topic + 1}: {' '.join(words)}")
+            print(share.round(3).to_string() if not share.empty else "索引中没有数据")
+    finally:
+        index.close()
+
+
+if __name__ == '__main__':
+    main()